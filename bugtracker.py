@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+import re
+import time
+import collections
+import random
+import threading
+import requests
+import bugzilla
+import ratelimit
+from concurrent.futures import ThreadPoolExecutor
+
+# rra2json=<RRA source> in the whiteboard of the bugs filed by rra2json.fill_bug()
+WHITEBOARD_SOURCE = re.compile(r'rra2json=(\S+)')
+# rra2json-digest=<recipient> in the whiteboard of the bugs filed by rra2json.fill_digest_bugs()
+WHITEBOARD_DIGEST = re.compile(r'rra2json-digest=(\S+)')
+# RRA link in digest bug descriptions and comments, see NagDigest.text()
+DIGEST_SOURCE = re.compile(r'docs\.google\.com/spreadsheets/d/([^)\s]+)')
+
+# Clients by (url, api key), see get_client()
+_clients = {}
+
+class BugzillaClient(bugzilla.Bugzilla):
+    '''
+    bugzilla.Bugzilla going through a single keep-alive session, with timeouts, and retries with exponential backoff
+    (with jitter) on connection errors and transient server errors. Errors are raised the same way as by
+    bugzilla.Bugzilla once retries are exhausted.
+    POST creates bugs and comments, so it's only retried when the server can't have acted on it: the connection
+    could not be made, or the server asked to come back later (429/503 with Retry-After).
+    @bcfg "bugzilla" configuration
+    '''
+    def __init__(self, bcfg):
+        bugzilla.Bugzilla.__init__(self, bcfg['url'], bcfg['api_key'])
+        self.workers = bcfg.get('concurrency', 4)
+        self.timeout = (bcfg.get('connect_timeout', 5), bcfg.get('read_timeout', 30))
+        self.retries = bcfg.get('retries', 3)
+        self.backoff = bcfg.get('backoff', 1.0)
+        self.stats = {'requests': 0, 'retries': 0}
+        self._stats_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def _request(self, method, q, payload='', params=''):
+        if (q[-1] == '/'): q = q[:-1]
+        url = '{url}{q}?api_key={key}{params}'.format(url=self.url, q=q, key=self.api_key, params=params)
+        attempt = 0
+        while True:
+            self._count('requests')
+            retry_after = None
+            try:
+                r = self.session.request(method, url, data=payload or None, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                if attempt >= self.retries or (method == 'POST' and not _not_sent(e)):
+                    raise
+            else:
+                if attempt >= self.retries or r.status_code not in ratelimit.THROTTLE_CODES:
+                    break
+                retry_after = ratelimit.parse_retry_after(r.headers.get('Retry-After'))
+                if method == 'POST' and (r.status_code not in [429, 503] or retry_after is None):
+                    break
+            self._count('retries')
+            if retry_after is None:
+                retry_after = random.uniform(0, self.backoff * 2**attempt)
+            time.sleep(retry_after)
+            attempt = attempt + 1
+
+        ret = bugzilla.DotDict(r.json())
+        if (not r.ok or ('error' in ret and ret.error == True)):
+            raise Exception(r.url, r.reason, r.status_code, ret)
+        return ret
+
+    def _count(self, key):
+        # put_bugs() makes requests from several threads
+        with self._stats_lock:
+            self.stats[key] = self.stats[key] + 1
+
+    def _get(self, q, params=''):
+        return self._request('GET', q, params=params)
+
+    def _post(self, q, payload='', params=''):
+        return self._request('POST', q, payload, params)
+
+    def _put(self, q, payload='', params=''):
+        return self._request('PUT', q, payload, params)
+
+    def put_bugs(self, updates):
+        '''
+        Update several bugs, up to self.workers at a time.
+        Yields (bug id, exception or None) for each of @updates, in the same order.
+        @updates list of (bug id, bugzilla.DotDict), see bugzilla.Bugzilla.put_bug()
+        '''
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [(bugid, executor.submit(self.put_bug, bugid, bug_up)) for bugid, bug_up in updates]
+            for bugid, future in futures:
+                yield bugid, future.exception()
+
+    def summary(self):
+        return '{requests} request(s), {retries} retries'.format(**self.stats)
+
+    def close(self):
+        self.session.close()
+
+def _not_sent(e):
+    '''
+    Returns True if requests exception @e means the request never made it to the server: the connection was refused,
+    the host could not be resolved or connecting timed out. Anything else (e.g. a read timeout) may have happened
+    after the server got the request.
+    '''
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError) and len(e.args) > 0:
+        return isinstance(getattr(e.args[0], 'reason', None), requests.packages.urllib3.exceptions.NewConnectionError)
+    return False
+
+def get_client(bcfg):
+    '''
+    Bugzilla client for @bcfg ("bugzilla" configuration), created on first use and then shared by everything that
+    talks to Bugzilla during the run, so that connections are reused.
+    '''
+    key = (bcfg['url'], bcfg['api_key'])
+    if key not in _clients:
+        _clients[key] = BugzillaClient(bcfg)
+    return _clients[key]
+
+def close_clients():
+    '''Close the connections of all clients returned by get_client(), at the end of the run'''
+    for client in _clients.values():
+        client.close()
+    _clients.clear()
+
+class AutoentryIndex(object):
+    '''
+    Open bugs filed by rra2json, by RRA source (whiteboard "autoentry rra2json=<RRA source>") and by digest recipient
+    (whiteboard "autoentry rra2json-digest=<recipient>", see NagDigest).
+    They're all fetched with a single (paged) search the first time the index is looked at, so that checking whether
+    an RRA was already reported is a lookup rather than a search per RRA. Runs that don't nag don't search at all.
+    @b bugzilla.Bugzilla
+    @bcfg "bugzilla" configuration
+    '''
+    def __init__(self, b, bcfg):
+        self.b = b
+        self.bcfg = bcfg
+        self._bugs = None
+        self._digests = None
+        # recipient => sources of the RRAs listed in its digest bug
+        self._digest_sources = {}
+
+    def _load(self):
+        bcfg = self.bcfg
+        page_size = bcfg.get('search_page_size', 500)
+        self._bugs = {}
+        self._digests = {}
+        # Bugzilla caps how many bugs a search returns, so they're fetched page by page until a short page comes back
+        offset = 0
+        while True:
+            terms = [{'product': bcfg['product']}, {'component': bcfg['component']},
+                    {'creator': bcfg['creator']}, {'whiteboard': 'autoentry'},
+                    {'resolution': ''},{'status': 'NEW'}, {'status': 'ASSIGNED'},
+                    {'status': 'REOPENED'}, {'status': 'UNCONFIRMED'},
+                    {'include_fields': 'id,whiteboard'}, {'order': 'bug_id'},
+                    {'limit': str(page_size)}, {'offset': str(offset)}
+                    ]
+            bugs = self.b.search_bugs(terms)['bugs']
+            for bug in bugs:
+                m = WHITEBOARD_SOURCE.search(bug.get('whiteboard', ''))
+                if m is not None:
+                    self._bugs[m.group(1)] = bug
+                m = WHITEBOARD_DIGEST.search(bug.get('whiteboard', ''))
+                if m is not None:
+                    self._digests[m.group(1)] = bug
+            if len(bugs) < page_size:
+                break
+            offset = offset + len(bugs)
+
+    def get(self, source):
+        '''Returns the open bug filed for RRA @source, or None'''
+        if self._bugs is None:
+            self._load()
+        return self._bugs.get(source)
+
+    def add(self, source, bug):
+        '''Record a bug filed for RRA @source during this run'''
+        if self._bugs is None:
+            self._load()
+        self._bugs[source] = bug
+
+    def get_digest(self, recipient):
+        '''Returns the open digest bug of @recipient (NagDigest.key()), or None'''
+        if self._digests is None:
+            self._load()
+        return self._digests.get(recipient)
+
+    def add_digest(self, recipient, bug, sources):
+        '''Record a digest bug filed for @recipient during this run, listing RRAs @sources'''
+        if self._digests is None:
+            self._load()
+        self._digests[recipient] = bug
+        self._digest_sources[recipient] = set(sources)
+
+    def digest_sources(self, recipient):
+        '''
+        Returns the set of sources of the RRAs already listed in the open digest bug of @recipient. They're read from
+        the bug's comments (its description being the first one), once per run and only for recipients with nags.
+        '''
+        bug = self.get_digest(recipient)
+        if bug is None:
+            return set()
+        if recipient not in self._digest_sources:
+            sources = set()
+            ret = self.b.get_comments(bug['id'])
+            for comment in ret['bugs'][str(bug['id'])]['comments']:
+                sources.update(DIGEST_SOURCE.findall(comment.get('text', '')))
+            self._digest_sources[recipient] = sources
+        return self._digest_sources[recipient]
+
+    def __len__(self):
+        if self._bugs is None:
+            return 0
+        return len(self._bugs)
+
+class NagDigest(object):
+    '''
+    Nags collected over a whole run, grouped by recipient: the RRA analyst, or its owner if it has no analyst. They're
+    then reported with a single bug per recipient (see rra2json.fill_digest_bugs()) rather than one bug per RRA.
+    '''
+    def __init__(self):
+        # recipient => [(RRA source, service name, nags), ...]
+        self.recipients = collections.OrderedDict()
+
+    @staticmethod
+    def recipient(rrajsondoc):
+        metadata = rrajsondoc.details.metadata
+        if len(metadata.analyst.strip()) > 0:
+            return metadata.analyst.strip()
+        return metadata.owner.strip()
+
+    @staticmethod
+    def key(recipient):
+        '''@recipient as it appears in whiteboards: no spaces'''
+        if len(recipient) == 0:
+            return 'nobody'
+        return re.sub(r'\s+', '_', recipient.lower())
+
+    def add(self, rrajsondoc, nags):
+        self.recipients.setdefault(self.recipient(rrajsondoc), []).append((rrajsondoc.source,
+            rrajsondoc.details.metadata.service, nags))
+
+    @staticmethod
+    def text(entries):
+        '''Bug description or comment listing the nags of @entries, items of self.recipients'''
+        res = []
+        for source, service, nags in entries:
+            res.append('{} (https://docs.google.com/spreadsheets/d/{}):'.format(service or source, source))
+            for nag in nags:
+                res.append('- {}'.format(nag['title']))
+            res.append('')
+        return '\n'.join(res)
+
+    def __len__(self):
+        return sum([len(entries) for entries in self.recipients.values()])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+import os
+import io
+import hashlib
+
+class DeadLetterQueue(object):
+    '''
+    On-disk queue of RRA JSON documents that could not be sent to service-map, so that they can be sent again later
+    (rra2json.py --replay-dlq) without fetching anything from Google.
+    There's one file per RRA source (spreadsheet id): a newer version of an RRA replaces the older one.
+    '''
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, source):
+        return os.path.join(self.path, '{}.json'.format(hashlib.sha1(source.encode('utf-8')).hexdigest()))
+
+    def put(self, source, payload):
+        '''
+        @source RRA source
+        @payload RRA JSON document (str)
+        '''
+        fname = self._file(source)
+        tmp = '{}.tmp'.format(fname)
+        with io.open(tmp, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(payload))
+        os.rename(tmp, fname)
+
+    def remove(self, source):
+        try:
+            os.remove(self._file(source))
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len([f for f in os.listdir(self.path) if f.endswith('.json')])
+
+    def items(self):
+        '''Yields (file name, payload) for all queued RRAs, oldest first'''
+        entries = []
+        for f in os.listdir(self.path):
+            if f.endswith('.json'):
+                fname = os.path.join(self.path, f)
+                entries.append((os.path.getmtime(fname), fname))
+        for mtime, fname in sorted(entries):
+            with io.open(fname, encoding='utf-8') as f:
+                yield fname, f.read()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+import os
+import json
+import zlib
+import hashlib
+import threading
+
+class GridCache(object):
+    '''
+    On-disk cache of worksheet grids (get_all_values() output), keyed by (spreadsheet id, worksheet title, updated).
+    As any change to a spreadsheet changes its updated date, an entry never needs to be invalidated, it just stops
+    being used and is eventually evicted.
+    Entries are zlib-compressed JSON files. Reading an entry marks it as recently used (mtime), and the least recently
+    used entries are deleted whenever the cache grows beyond @max_size bytes.
+    '''
+    def __init__(self, path, max_size=100*1024*1024):
+        self.path = path
+        self.max_size = max_size
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._size = sum([os.path.getsize(f) for f in self._files()])
+
+    def _files(self):
+        return [os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith('.json.z')]
+
+    def _file(self, sheet_id, title, updated):
+        key = json.dumps([sheet_id, title, updated]).encode('utf-8')
+        return os.path.join(self.path, '{}.json.z'.format(hashlib.sha1(key).hexdigest()))
+
+    def get(self, sheet_id, title, updated):
+        '''
+        Returns the cached worksheet as a dict with title, updated and data keys, or None if it is not cached.
+        @title worksheet title, or None for the first worksheet
+        @updated spreadsheet updated date
+        '''
+        fname = self._file(sheet_id, title, updated)
+        try:
+            with open(fname, 'rb') as f:
+                entry = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+            os.utime(fname, None)
+        except (IOError, OSError, ValueError, zlib.error):
+            with self._lock:
+                self.stats['misses'] = self.stats['misses'] + 1
+            return None
+        with self._lock:
+            self.stats['hits'] = self.stats['hits'] + 1
+        return entry
+
+    def put(self, sheet_id, title, updated, entry):
+        '''
+        Store a worksheet, see get()
+        @entry dict with title, updated and data (grid) keys
+        '''
+        fname = self._file(sheet_id, title, updated)
+        blob = zlib.compress(json.dumps(entry).encode('utf-8'))
+        tmp = '{}.{}.tmp'.format(fname, threading.current_thread().ident)
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.rename(tmp, fname)
+
+        with self._lock:
+            self._size = self._size + len(blob)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        '''Delete least recently used entries until we're back to 3/4 of max_size, so that this doesn't run on every
+        put(). Also recomputes the real cache size, as put() may have replaced existing entries.'''
+        entries = []
+        for fname in self._files():
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fname))
+        entries.sort()
+
+        self._size = sum([e[1] for e in entries])
+        for mtime, size, fname in entries:
+            if self._size <= self.max_size * 3 / 4:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                continue
+            self._size = self._size - size
+            self.stats['evictions'] = self.stats['evictions'] + 1
+
+    def summary(self):
+        return '{hits} hits, {misses} misses, {evictions} evictions'.format(**self.stats)
@@ -7,8 +7,10 @@
 # Contributors:
 # Guillaume Destuynder <gdestuynder@mozilla.com>
 
+import re
+import difflib
 import pytz
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.parser import parse
 from tokenize import generate_tokens
 import io
@@ -18,48 +20,156 @@ except ImportError:
     from io import StringIO
 import os
 
-def toUTC(suspectedDate=datetime.now(), localTimeZone=None):
-    '''Anything => UTC date. Magic.'''
-    if (localTimeZone == None):
-        if (len(os.environ['TZ']) > 0):
-            localTimeZone = os.environ['TZ']
+# Strings that are ISO 8601 dates, such as Google's updated dates and our own isoformat() output
+ISO8601 = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?(Z|[+-]\d{2}:?\d{2})?$')
+
+# Resolved local timezone, for the TZ environment variable value it was resolved from
+_local_tz = {}
+# String => UTC date, as the same few dates (lastmodified, ...) are converted again and again
+_utc_dates = {}
+UTC_DATES_MAX = 4096
+
+def local_timezone():
+    '''The local pytz timezone: TZ, else /etc/localtime, else UTC'''
+    tz = os.environ.get('TZ', '')
+    try:
+        return _local_tz[tz]
+    except KeyError:
+        pass
+
+    if len(tz) > 0:
+        name = tz
+    else:
+        try:
+            name = '/'.join(os.path.realpath('/etc/localtime').split('/')[-2:])
+        except:
+            name = 'UTC'
+    try:
+        _local_tz[tz] = pytz.timezone(name)
+    except pytz.exceptions.UnknownTimeZoneError:
+        #Meh if all fails, I decide you're UTC!
+        _local_tz[tz] = pytz.UTC
+    return _local_tz[tz]
+
+def parse_iso8601(value, tz):
+    '''
+    Returns the UTC date of ISO 8601 @value, with @tz (pytz timezone) as timezone if @value has none, or None if
+    @value isn't an ISO 8601 date.
+    '''
+    m = ISO8601.match(value)
+    if m is None:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = m.groups()
+    objDate = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0),
+            int((fraction or '0').ljust(6, '0')))
+    if offset is None:
+        return pytz.UTC.normalize(tz.localize(objDate))
+    objDate = pytz.UTC.localize(objDate)
+    if offset != 'Z':
+        offset = offset.replace(':', '')
+        delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+        if offset[0] == '+':
+            objDate = objDate - delta
         else:
-            try:
-                localTimeZone = '/'.join(os.path.realpath('/etc/localtime').split('/')[-2:])
-            except:
-                localTimeZone = 'UTC'
-    utc = pytz.UTC
-    objDate = None
-    if (type(suspectedDate) == str):
-        objDate = parse(suspectedDate, fuzzy=True)
-    elif (type(suspectedDate) == datetime):
-        objDate=suspectedDate
+            objDate = objDate + delta
+    return objDate
+
+def toUTC(suspectedDate=None, localTimeZone=None):
+    '''
+    Anything => UTC date. Magic.
+    @suspectedDate datetime or string, defaults to now. Dates without a timezone are in @localTimeZone.
+    @localTimeZone timezone name, defaults to local_timezone()
+    ISO 8601 strings are parsed directly, anything else goes through dateutil's fuzzy parser. String results are
+    memoized.
+    '''
+    if suspectedDate is None:
+        suspectedDate = datetime.now()
 
-    if (objDate.tzinfo is None):
+    if localTimeZone is None:
+        tz = local_timezone()
+    else:
         try:
-            objDate=pytz.timezone(localTimeZone).localize(objDate)
+            tz = pytz.timezone(localTimeZone)
         except pytz.exceptions.UnknownTimeZoneError:
-            #Meh if all fails, I decide you're UTC!
-            objDate=pytz.timezone('UTC').localize(objDate)
-        objDate=utc.normalize(objDate)
-    else:
-        objDate=utc.normalize(objDate)
-    if (objDate is not None):
-        objDate=utc.normalize(objDate)
+            tz = pytz.UTC
+
+    if isinstance(suspectedDate, datetime):
+        if suspectedDate.tzinfo is None:
+            suspectedDate = tz.localize(suspectedDate)
+        return pytz.UTC.normalize(suspectedDate)
+
+    key = (suspectedDate, tz.zone)
+    try:
+        return _utc_dates[key]
+    except KeyError:
+        pass
 
+    objDate = parse_iso8601(suspectedDate, tz)
+    if objDate is None:
+        objDate = parse(suspectedDate, fuzzy=True)
+        if objDate.tzinfo is None:
+            objDate = tz.localize(objDate)
+        objDate = pytz.UTC.normalize(objDate)
+
+    if len(_utc_dates) >= UTC_DATES_MAX:
+        _utc_dates.clear()
+    _utc_dates[key] = objDate
     return objDate
 
+def normalize_label(value):
+    '''How cell values are compared to the labels we look for: case insensitive, ignoring surrounding spaces and
+    treating new lines as spaces'''
+    return value.lower().strip().replace('\n', ' ')
+
+class SheetIndex(list):
+    '''
+    Worksheet data, i.e. list(list(), ...) as returned by gspread.model.Worksheet.get_all_values(), along with an index
+    of each normalized cell value to its positions.
+    Parsers use it exactly like the plain list, but list_find()/cell_value_near() become a dictionary lookup instead
+    of a scan of the whole grid. The index is built on the first lookup, once per grid.
+    '''
+    def __init__(self, data):
+        list.__init__(self, data)
+        self._labels = None
+
+    def _build(self):
+        labels = {}
+        for x, cells in enumerate(self):
+            seen = set()
+            for y, item in enumerate(cells):
+                label = normalize_label(item)
+                # Like list.index(), only the first match of each row counts
+                if label in seen:
+                    continue
+                seen.add(label)
+                try:
+                    labels[label].append((x, y))
+                except KeyError:
+                    labels[label] = [(x, y)]
+        self._labels = labels
+
+    def list_find(self, value):
+        '''See list_find()'''
+        if self._labels is None:
+            self._build()
+        return iter(self._labels.get(value.lower(), []))
+
 def list_find(data, value):
     '''Return position (index) in list of list, of the first @value found.
     The match is case insensitive.
     Returns empty list if nothing is found.
-    @data = list(list(), ...)
+    @data = list(list(), ...) or SheetIndex
     @value str'''
+    if isinstance(data, SheetIndex):
+        return data.list_find(value)
+    return _list_find(data, value)
+
+def _list_find(data, value):
     value = value.lower()
 
     for x, cells in enumerate(data):
         try:
-            cells_lower = [item.lower().strip().lstrip().replace('\n', ' ') for item in cells]
+            cells_lower = [normalize_label(item) for item in cells]
             y = cells_lower.index(value)
         except ValueError:
             continue
@@ -80,32 +190,211 @@ def cell_value_near(s, value, xmoves=1, ymoves=0):
 
     Function returns empty string if nothing is found.
 
-    @s: worksheet list data (s=[row][col]) from gspread.model.Worksheet.get_all_values()
+    @s: worksheet list data (s=[row][col]) from gspread.model.Worksheet.get_all_values(), preferably as a SheetIndex
     @value: string
     @xmoves, ymoves: number of right lateral moves to find the field value to return
+    Raises IndexError if @value is not found at all.
     '''
 
-    res = [match for match in list_find(s, value)][0]
+    try:
+        res = next(list_find(s, value))
+    except StopIteration:
+        raise IndexError('{} not found'.format(value))
 
     # Nothing found
     if len(res) == 0:
         return ''
 
+    return cell_at(s, res, xmoves, ymoves)
+
+def cell_at(s, pos, xmoves=1, ymoves=0):
+    '''
+    Returns value of the cell at @xmoves, @ymoves from @pos (row, col), or an empty string if that's outside of the
+    sheet. See cell_value_near().
+    '''
     try:
-        return s[res[0]+ymoves][res[1]+xmoves].strip('\n')
+        return s[pos[0]+ymoves][pos[1]+xmoves].strip('\n')
     except IndexError:
         return ''
 
+def find_label(s, labels):
+    '''
+    Returns (index in @labels, position) of the first of @labels found in @s, where @labels are aliases of the same
+    field in order of preference, e.g. ['Probability', 'Likelihood Indicator'] as templates changed over time.
+    Position is the same as the first list_find() result for that label.
+    With a SheetIndex this is one dictionary lookup per alias, with a plain list the grid is scanned once for all of
+    them, so fallback labels cost nothing extra.
+    Raises IndexError if none of @labels is found.
+    @s: worksheet list data (s=[row][col]), preferably as a SheetIndex
+    @labels: list of strings
+    '''
+    if isinstance(s, SheetIndex):
+        for i, label in enumerate(labels):
+            for pos in s.list_find(label):
+                return i, pos
+        raise IndexError('{} not found'.format(' / '.join(labels)))
+
+    wanted = {}
+    for i, label in enumerate(labels):
+        wanted.setdefault(label.lower(), i)
+    found = {}
+    for x, cells in enumerate(s):
+        for y, item in enumerate(cells):
+            i = wanted.get(normalize_label(item))
+            if i is not None and i not in found:
+                found[i] = (x, y)
+        # Nothing can beat the preferred label
+        if 0 in found:
+            break
+    if len(found) == 0:
+        raise IndexError('{} not found'.format(' / '.join(labels)))
+    i = min(found)
+    return i, found[i]
+
+def table_near(s, value, columns, max_rows=100):
+    '''
+    Returns the table found under the first cell containing 'value' (its header), as a list of rows.
+    Each row is a tuple of the values of the cells at the @columns offsets from the header's column, i.e. with
+    columns=[0, 2] each row is (value under the header, value 2 cells right of that).
+    The header is looked up once and rows are read in a single pass, until the cell at the first of @columns is empty,
+    the end of the sheet is reached, or @max_rows rows were read. Cells outside of the sheet read as empty strings.
+
+    Ex:
+       A      | B     | C
+    1| Type   |       | Level
+    2| Foo    |       | PUBLIC
+    3| Bar    |       | SECRET
+    4|        |       |
+
+    table_near(s, 'Level', [0, -2]) will return [('PUBLIC', 'Foo'), ('SECRET', 'Bar')]
+
+    @s: worksheet list data (s=[row][col]), preferably as a SheetIndex
+    @value: string
+    @columns: list of x offsets
+    @max_rows: safeguard in case the table does not end where expected due to unexpected data in the sheet
+    Raises IndexError if @value is not found at all.
+    '''
+    try:
+        pos = next(list_find(s, value))
+    except StopIteration:
+        raise IndexError('{} not found'.format(value))
+
+    return table_at(s, pos, columns, max_rows)
+
+def table_at(s, pos, columns, max_rows=100):
+    '''
+    Returns the table under its header cell at @pos (row, col). See table_near().
+    '''
+    x, y = pos
+    rows = []
+    for cells in s[x+1:x+1+max_rows]:
+        row = []
+        for col in columns:
+            if y+col < 0 or y+col >= len(cells):
+                row.append('')
+            else:
+                row.append(cells[y+col].strip('\n'))
+        if row[0] == '':
+            break
+        rows.append(tuple(row))
+    return rows
+
+class LevelTable(object):
+    '''
+    Normalizes values to one of a list of levels (data levels, risk levels...) with a single dictionary lookup.
+    @levels list of levels, which map to themselves
+    @aliases dict of level => list of other names for it
+    @fuzzy_cutoff if > 0, values matching no level or alias are mapped to the closest one if they're at least that
+    similar (0 to 1, see difflib.get_close_matches()). Results are cached as the same values come back a lot.
+    @fold_case if True, matching is case insensitive
+    '''
+    def __init__(self, levels, aliases={}, fuzzy_cutoff=0, fold_case=False):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.fold_case = fold_case
+        self._table = {}
+        for level, names in aliases.items():
+            for name in names:
+                self._table[self._key(name)] = level
+        for level in levels:
+            self._table[self._key(level)] = level
+        self._fuzzy = {}
+
+    def _key(self, value):
+        if self.fold_case:
+            return value.upper()
+        return value
+
+    def lookup(self, value):
+        '''Returns the level @value stands for, or None'''
+        key = self._key(value)
+        try:
+            return self._table[key]
+        except KeyError:
+            pass
+        if self.fuzzy_cutoff <= 0:
+            return None
+
+        try:
+            return self._fuzzy[key]
+        except KeyError:
+            pass
+        match = difflib.get_close_matches(key, list(self._table.keys()), 1, self.fuzzy_cutoff)
+        if len(match) > 0:
+            self._fuzzy[key] = self._table[match[0]]
+        else:
+            self._fuzzy[key] = None
+        return self._fuzzy[key]
+
+# Data level => other names for it, see normalize_data_level(). level_aliases.data in rra2json.json adds to these.
+DATA_LEVEL_ALIASES = {
+    'UNKNOWN': [],
+    'PUBLIC': [],
+    'INTERNAL': ['CONFIDENTIAL INTERNAL', 'STAFF', 'NDA', 'MOZILLA CONFIDENTIAL - STAFF AND NDA\'D MOZILLIANS ONLY'],
+    'RESTRICTED': ['CONFIDENTIAL RESTRICTED', 'WORKGROUP', 'WORK GROUP',
+        'MOZILLA CONFIDENTIAL - SPECIFIC WORK GROUPS ONLY', 'MOZILLA CONFIDENTIAL WORK GROUPS ONLY'],
+    'SECRET': ['CONFIDENTIAL SECRET', 'INDIVIDUAL', 'MOZILLA CONFIDENTIAL - SPECIFIC INDIVIDUALS ONLY',
+        'MOZILLA CONFIDENTIAL INDIVIDUAL ONLY'],
+}
+
+_data_levels = LevelTable(list(DATA_LEVEL_ALIASES.keys()), DATA_LEVEL_ALIASES, fold_case=True)
+# tuple(allowed) => LevelTable, see validate_entry()
+_entry_tables = {}
+
+def configure_levels(risk_levels, level_aliases):
+    '''
+    Compile the level tables used by normalize_data_level() and validate_entry(), once at startup.
+    @risk_levels list of risk levels allowed
+    @level_aliases "level_aliases" configuration: {"data": {level: [names]}, "risk": {level: [names]}, "fuzzy_cutoff": n}
+    '''
+    global _data_levels
+    cutoff = level_aliases.get('fuzzy_cutoff', 0)
+
+    aliases = dict([(level, list(names)) for level, names in DATA_LEVEL_ALIASES.items()])
+    for level, names in level_aliases.get('data', {}).items():
+        aliases.setdefault(level, []).extend(names)
+    _data_levels = LevelTable(list(aliases.keys()), aliases, cutoff, fold_case=True)
+
+    _entry_tables.clear()
+    _entry_tables[tuple(risk_levels)] = LevelTable(risk_levels, level_aliases.get('risk', {}), cutoff)
+
 def validate_entry(value, allowed):
     '''
     Check input value against a list of allowed data
     Return value or 'Unknown'.
+    For the risk levels, configured aliases are also accepted, see configure_levels().
     @allowed: list()
     @value: str
     '''
-    if value in allowed:
-        return value.strip('\n')
-    return 'Unknown'
+    key = tuple(allowed)
+    try:
+        table = _entry_tables[key]
+    except KeyError:
+        table = _entry_tables[key] = LevelTable(allowed)
+
+    level = table.lookup(value)
+    if level is None:
+        return 'Unknown'
+    return level.strip('\n')
 
 def quick_tokenizer(value, token_max_val=5):
     '''
@@ -147,31 +436,12 @@ def fuzzy_find_team_name(value):
 def normalize_data_level(value):
     '''
     Takes a data level such as "Unknown", "PUBLIC", "CONFIDENTIAL INTERNAL", etc. and attempt to normalize it.
-    /!\ This function needs to be synchronized with your data_levels if they're modified.
-    This function is hardcoded as having a generic map would make little sense to most outside of Mozilla, and things
-    will still work if this function is not normalizing anything. Hurrai hacks!
+    /!\ DATA_LEVEL_ALIASES needs to be synchronized with your data_levels if they're modified, or extended through
+    level_aliases in rra2json.json. Things will still work if this function is not normalizing anything.
     '''
-
-    data_level = value.upper()
-    if data_level in ['UNKNOWN']:
-        return 'UNKNOWN'
-
-    if data_level in ['PUBLIC']:
-        return 'PUBLIC'
-
-    if data_level in ['INTERNAL', 'CONFIDENTIAL INTERNAL', 'STAFF', 'NDA',
-            'MOZILLA CONFIDENTIAL - STAFF AND NDA\'D MOZILLIANS ONLY']:
-        return 'INTERNAL'
-
-    if data_level in ['RESTRICTED', 'CONFIDENTIAL RESTRICTED', 'WORKGROUP', 'WORK GROUP',
-            'MOZILLA CONFIDENTIAL - SPECIFIC WORK GROUPS ONLY', 'MOZILLA CONFIDENTIAL WORK GROUPS ONLY']:
-        return 'RESTRICTED'
-
-    if data_level in ['SECRET', 'CONFIDENTIAL SECRET', 'INDIVIDUAL',
-            'MOZILLA CONFIDENTIAL - SPECIFIC INDIVIDUALS ONLY', 'MOZILLA CONFIDENTIAL INDIVIDUAL ONLY']:
-        return 'SECRET'
+    level = _data_levels.lookup(value)
 
     #If all else fails, do not normalize
-    return value
-
-
+    if level is None:
+        return value
+    return level
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+# Parallel parsing of documents whose grids are already local (exported snapshots), over a pool of processes.
+# Parsing is pure CPU, so this scales with the number of cores where threads would not.
+# Only plain data crosses process boundaries: snapshots go in as dicts (sheetgrid.SnapshotGrid.to_dict()), documents
+# come back as dicts (rradoc.RRADocument.to_dict()).
+
+import collections
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import parselib
+import sheetgrid
+import rradoc
+import rra_parsers
+from rra_parsers import engine
+
+# Parser registry of the worker process, built on its first chunk
+_parsers = None
+
+def _parse_chunk(snaps, skel, data_levels, risk_levels, level_aliases):
+    '''
+    Worker: parse a list of snapshot dicts.
+    Returns ([(status, RRA version, document dict or None, traceback or None), ...], engine statistics). Status is
+    as returned by rra_parsers.parse_document(), or 'error' if the parser raised an exception.
+    '''
+    global _parsers
+    if _parsers is None:
+        _parsers = rra_parsers.build_registry()
+        parselib.configure_levels(risk_levels, level_aliases)
+
+    res = []
+    for snap in snaps:
+        s = sheetgrid.snapshot_from_dict(snap)
+        try:
+            status, rra_version, doc = rra_parsers.parse_document(_parsers, None, s, s.title, skel, data_levels,
+                    risk_levels)
+        except Exception:
+            res.append(('error', None, None, traceback.format_exc()))
+            continue
+        res.append((status, rra_version, None if doc is None else doc.to_dict(), None))
+
+    # Hand the statistics of this chunk over to the parent, and start over for the next one
+    stats = (dict(engine.label_stats), dict(engine.anchor_stats), engine.anchors)
+    engine.label_stats.clear()
+    engine.anchor_stats.clear()
+    return res, stats
+
+def _merge_stats(stats):
+    label_stats, anchor_stats, anchors = stats
+    engine.label_stats.update(label_stats)
+    engine.anchor_stats.update(anchor_stats)
+    for version, labels in anchors.items():
+        engine.anchors.setdefault(version, {}).update(labels)
+
+def _chunks(snapshots, chunk_size):
+    chunk = []
+    for s in snapshots:
+        chunk.append(s)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+def parse_snapshots(snapshots, skel, data_levels, risk_levels, level_aliases, workers=2, chunk_size=16):
+    '''
+    Yields (snapshot, status, RRA version, rradoc.RRADocument or None, traceback or None) for each of @snapshots,
+    in the same order as @snapshots, see _parse_chunk() for status.
+    Snapshots are sent to @workers processes in chunks of @chunk_size, and no more than 2*@workers chunks are in
+    flight at a time.
+    @snapshots iterable of sheetgrid.SnapshotGrid
+    @skel, @data_levels, @risk_levels see rra_parsers.parse_document()
+    @level_aliases see parselib.configure_levels()
+    '''
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for chunk in _chunks(snapshots, chunk_size):
+            future = executor.submit(_parse_chunk, [s.to_dict() for s in chunk], skel, list(data_levels),
+                    list(risk_levels), level_aliases)
+            pending.append((chunk, future))
+            if len(pending) >= workers*2:
+                for r in _results(*pending.popleft()):
+                    yield r
+        while len(pending) > 0:
+            for r in _results(*pending.popleft()):
+                yield r
+
+def _results(chunk, future):
+    res, stats = future.result()
+    _merge_stats(stats)
+    for s, (status, rra_version, doc, tb) in zip(chunk, res):
+        if doc is not None:
+            doc = rradoc.RRADocument.from_dict(doc)
+        yield s, status, rra_version, doc, tb
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+# Staged processing: each stage runs in its own thread(s), and stages are connected by bounded queues. While a
+# document is being parsed, the next ones are being fetched and the previous one posted, so a run takes about as long
+# as its slowest stage rather than the sum of all stages, and no more than a few documents per stage are in memory.
+
+import sys
+import time
+import threading
+# Python2 fun
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# End of input marker, one per worker
+_DONE = object()
+
+class Stage(object):
+    def __init__(self, name, func, workers, maxsize):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.input = queue.Queue(maxsize)
+        self.processed = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+        # Reordering of processed items, see Pipeline._release()
+        self._cond = threading.Condition()
+        self._next = 0
+        self._processed = {}
+        self._emitted = 0
+
+    def put(self, item):
+        self.input.put(item)
+        depth = self.input.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+class Pipeline(object):
+    '''
+    Items go through stages in the order they were add()ed. A stage function takes an item and returns it (modified
+    or not) for the next stage, or None to drop it. Items come out of run() once they went through all stages.
+    Stages with several workers process items in parallel, but items are always passed on in the order they went in,
+    so that the output (and what's logged along the way) is the same as with a single worker. A worker that's done
+    with an item more than maxsize items ahead of the oldest one still being processed waits for it.
+    If a stage function (or the input) raises an exception, the pipeline is drained and the exception is raised again
+    by run().
+    @maxsize how many items can wait in front of each stage
+    '''
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.stages = []
+        self.started = None
+        self._error = None
+
+    def add(self, name, func, workers=1):
+        self.stages.append(Stage(name, func, workers, self.maxsize))
+        return self
+
+    def depths(self):
+        '''Returns [(stage name, items waiting in front of it), ...], e.g. to see which stage is the bottleneck'''
+        return [(stage.name, stage.input.qsize()) for stage in self.stages]
+
+    def summary(self):
+        res = []
+        for stage in self.stages:
+            res.append('{}: {} item(s), {:.1f}s busy, max queue {}'.format(stage.name, stage.processed, stage.busy,
+                stage.max_depth))
+        if self.started is not None:
+            res.append('{:.1f}s total'.format(time.time() - self.started))
+        return ', '.join(res)
+
+    def run(self, items):
+        '''
+        Yields items of iterable @items once processed by all stages. @items is iterated over in its own thread, so
+        it can be slow (e.g. a listing that's fetched page by page) too.
+        '''
+        self.started = time.time()
+        output = Stage('output', None, 1, self.maxsize)
+        queues = self.stages + [output]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]))]
+        for stage, next_stage in zip(self.stages, queues[1:]):
+            workers = [threading.Thread(target=self._work, args=(stage, next_stage)) for i in range(stage.workers)]
+            threads.extend(workers)
+            threads.append(threading.Thread(target=self._close, args=(workers, next_stage)))
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        while True:
+            entry = output.input.get()
+            if entry is _DONE:
+                break
+            yield entry[1]
+        for t in threads:
+            t.join()
+        if self._error is not None:
+            raise self._error[1]
+
+    def _feed(self, items, first):
+        try:
+            for seq, item in enumerate(items):
+                if self._error is not None:
+                    break
+                first.put((seq, item))
+        except BaseException:
+            self._error = sys.exc_info()
+        for i in range(first.workers):
+            first.put(_DONE)
+
+    def _work(self, stage, next_stage):
+        while True:
+            entry = stage.input.get()
+            if entry is _DONE:
+                return
+            seq, item = entry
+            # Something failed, just keep the queue moving so that nothing upstream stays blocked
+            if self._error is not None:
+                self._release(stage, next_stage, seq, None)
+                continue
+            start = time.time()
+            try:
+                item = stage.func(item)
+            except BaseException:
+                self._error = sys.exc_info()
+                item = None
+            with stage._lock:
+                stage.processed = stage.processed + 1
+                stage.busy = stage.busy + time.time() - start
+            self._release(stage, next_stage, seq, item)
+
+    def _release(self, stage, next_stage, seq, item):
+        # Items are passed on in input order: processed items wait until all items before them are processed. Dropped
+        # items (None) are not passed on, so items are numbered again for the next stage.
+        with stage._cond:
+            while seq >= stage._next + self.maxsize:
+                stage._cond.wait()
+            stage._processed[seq] = item
+            while stage._next in stage._processed:
+                item = stage._processed.pop(stage._next)
+                if item is not None:
+                    next_stage.put((stage._emitted, item))
+                    stage._emitted = stage._emitted + 1
+                stage._next = stage._next + 1
+            stage._cond.notify_all()
+
+    def _close(self, workers, next_stage):
+        # The next stage is done once all workers of this one are
+        for t in workers:
+            t.join()
+        for i in range(next_stage.workers):
+            next_stage.put(_DONE)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+import threading
+import time
+import email.utils
+
+# HTTP status codes that mean "slow down" rather than "this request is wrong"
+THROTTLE_CODES = [429, 500, 502, 503, 504]
+
+def throttle_info(e):
+    '''
+    Returns (status code, retry after in seconds or None) if exception @e is a throttling/transient server error,
+    (None, None) otherwise.
+    gspread raises RequestError(status_code, message), requests raises HTTPError with a .response attached.
+    '''
+    status = None
+    retry_after = None
+    response = getattr(e, 'response', None)
+    if response is not None:
+        status = response.status_code
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    elif len(e.args) > 0 and isinstance(e.args[0], int):
+        status = e.args[0]
+
+    # Google also reports quota issues as 403 with a rateLimitExceeded/userRateLimitExceeded reason
+    if status == 403 and 'ratelimitexceeded' in str(e).lower():
+        return status, retry_after
+    if status in THROTTLE_CODES:
+        return status, retry_after
+    return None, None
+
+def parse_retry_after(value):
+    '''Retry-After is either a number of seconds or an HTTP date'''
+    if value is None:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, email.utils.mktime_tz(date) - time.time())
+
+class RateLimiter(object):
+    '''
+    Rate limiting for API calls that may be made from several threads:
+    - a token bucket caps the request rate (@rate requests/second, with bursts of up to @burst requests),
+    - the number of calls in flight is adjusted AIMD-style: +1 every @max_concurrency successful calls, halved on
+      every throttling response, between 1 and @max_concurrency,
+    - throttled calls are retried up to @retries times, waiting for Retry-After if the server sent one, or for an
+      exponential backoff starting at @backoff seconds. Everyone waits, not just the throttled caller.
+    Use call(func, *args, **kwargs) in lieu of func(*args, **kwargs).
+    '''
+    def __init__(self, rate=10, burst=10, max_concurrency=1, retries=5, backoff=1.0):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.limit = float(self.max_concurrency)
+        self.stats = {'calls': 0, 'throttled': 0, 'retries': 0, 'waited': 0.0, 'min_concurrency': self.max_concurrency}
+
+        self._tokens = self.burst
+        self._last = time.time()
+        self._inflight = 0
+        self._resume_at = 0
+        self._cond = threading.Condition()
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                ret = func(*args, **kwargs)
+            except Exception as e:
+                status, retry_after = throttle_info(e)
+                self._release(status is not None, retry_after, attempt, False)
+                if status is None or attempt >= self.retries:
+                    raise
+                attempt = attempt + 1
+                with self._cond:
+                    self.stats['retries'] = self.stats['retries'] + 1
+                continue
+            self._release(False, None, attempt, True)
+            return ret
+
+    def _acquire(self):
+        start = time.time()
+        with self._cond:
+            while True:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+
+                if now < self._resume_at:
+                    wait = self._resume_at - now
+                elif self._inflight >= int(self.limit):
+                    wait = None
+                elif self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    break
+                self._cond.wait(wait)
+
+            self._tokens = self._tokens - 1
+            self._inflight = self._inflight + 1
+            self.stats['calls'] = self.stats['calls'] + 1
+            self.stats['waited'] = self.stats['waited'] + (time.time() - start)
+
+    def _release(self, throttled, retry_after, attempt, ok):
+        with self._cond:
+            self._inflight = self._inflight - 1
+            if throttled:
+                self.stats['throttled'] = self.stats['throttled'] + 1
+                self.limit = max(1.0, self.limit / 2)
+                self.stats['min_concurrency'] = min(self.stats['min_concurrency'], int(self.limit))
+                if retry_after is None:
+                    retry_after = self.backoff * (2 ** attempt)
+                self._resume_at = max(self._resume_at, time.time() + retry_after)
+            elif ok:
+                # Other errors say nothing about how much the server can take
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.max_concurrency)
+            self._cond.notify_all()
+
+    def summary(self):
+        return '{calls} API calls, {throttled} throttled, {retries} retried, {waited:.1f}s spent waiting, ' \
+               'concurrency went down to {min_concurrency}'.format(**self.stats)
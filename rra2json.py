@@ -12,14 +12,21 @@ from oauth2client.client import SignedJwtAssertionCredentials
 import gspread
 import os
 import hjson as json
-import json as rjson
 from xml.etree import ElementTree as et
 import sys
 import collections
-import copy
 import parselib
+import sheetgrid
+import ratelimit
+import gridcache
+import rra_parsers
+import rradoc
+import parsepool
+import servicemap
+import bugtracker
+import pipeline
+import deadletter
 import bugzilla
-import requests
 import dateutil.parser
 import pickle
 import argparse
@@ -30,17 +37,12 @@ try:
 except NameError:
     FileNotFoundError = IOError
 
-class DotDict(dict):
-    '''dict.item notation for dict()'s'''
-    __getattr__ = dict.__getitem__
-    __setattr__ = dict.__setitem__
-    __delattr__ = dict.__delitem__
+# Sync outcomes that will not change unless the document itself changes. Anything else (nag grace period, debug
+# runs, ...) is looked at again on the next run.
+SYNC_FINAL = ['posted', 'unchanged', 'nagged', 'nonag', 'notrra', 'unsupported']
 
-    def __init__(self, dct):
-        for key, value in dct.items():
-            if hasattr(value, 'keys'):
-                value = DotDict(value)
-            self[key] = value
+# How often (in documents) to log the pipeline's queue depths
+PIPELINE_LOG_EVERY = 50
 
 def fatal(msg):
     print(msg)
@@ -49,25 +51,30 @@ def fatal(msg):
 def debug(msg):
     sys.stderr.write('+++ {}\n'.format(msg))
 
-def post_rra_to_servicemap(cfg, rrajsondoc):
-    url = '{proto}://{host}:{port}{endpoint}'.format(proto=cfg['proto'], host=cfg['host'],
-                                                        port=cfg['port'], endpoint=cfg['endpoint'])
-    payload = rjson.dumps(rrajsondoc)
-
-    if len(cfg['x509cert']) > 1:
-        verify=cfg['x509cert']
-    elif cfg['tls_verify'] == "true":
-        verify=True
-    else:
-        verify=False
+def post_rra_to_servicemap(smap, rrajsondoc):
+    '''
+    Returns 'posted', 'unchanged' if the RRA did not change since it was last posted (it's not sent again), or
+    'postfailed' if service-map could not be reached or refused the RRA (it's then in the dead-letter queue, if
+    configured). Queued RRAs are 'posted' until proven otherwise, see finish_posting().
+    @smap servicemap.ServiceMap
+    '''
+    digest = rrajsondoc.digest()
+    if smap.unchanged(rrajsondoc.source, digest):
+        return 'unchanged'
+    payload = rrajsondoc.to_json()
 
     #Hack to get a version number, until this is fetched from the gdrive API
     rrajsondoc['version'] = dateutil.parser.parse(rrajsondoc['lastmodified']).strftime('%s')
 
-    headers = {'SERVICEAPIKEY': cfg['apikey']}
-    r = requests.post(url, data=payload, headers=headers, verify=verify)
-    if r.status_code != requests.codes.ok:
-        fatal("Failed to send RRA to servicemap (nag missing?): error code: {} message: {} rra: {}".format(r.status_code, r.content, rrajsondoc['source']))
+    # Batched, see finish_posting()
+    if smap.bulk:
+        smap.queue(rrajsondoc.source, payload, digest)
+        return 'posted'
+
+    # A single failure should not stop the run, failures are reported by finish_posting()
+    if smap.send(rrajsondoc.source, payload, digest) is not None:
+        return 'postfailed'
+    return 'posted'
 
 def gspread_authorize(email, private_key, scope, secret=None):
     '''
@@ -80,63 +87,103 @@ def gspread_authorize(email, private_key, scope, secret=None):
         credentials = SignedJwtAssertionCredentials(email, private_key, [scope])
     return gspread.authorize(credentials)
 
-def get_sheet_titles(gc):
+# Google spreadsheets feed (Atom) helpers
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+SPREADSHEETS_FEED = 'https://spreadsheets.google.com/feeds/spreadsheets/private/full'
+
+def list_spreadsheets(gc, limiter):
     '''
-    List all sheets (Atom elements)
+    List all spreadsheets, following the feed pagination. This is a generator: each feed page is parsed as it is
+    downloaded, and each entry is yielded as soon as it is parsed and then dropped, so that documents can start being
+    processed before the listing is complete, and memory use does not depend on the number of spreadsheets.
+    Yields gspread.Spreadsheet objects, whose id, title and updated date are known without any further API call.
     '''
-    data = {}
-    et_sheets = gc.get_spreadsheets_feed()
-    et_entries = et_sheets.findall('{http://www.w3.org/2005/Atom}entry')
-
-    for et_entry in et_entries:
-        # That's where the link with sheet ID always is, basically, since it's not named as such and there's several
-        # links...
-        link = et_entry.findall('{http://www.w3.org/2005/Atom}link')[1].attrib['href']
-        #Links look like 'https://docs.google.com/spreadsheets/d/1nNhoENKv5qR6l_Ch2loYj0D9fQ_bNCz2pbHAEYssh-X/edit'
-        #Where 1nNhoENKv5qR6l_Ch2loYj0D9fQ_bNCz2pbHAEYssh-X would be the ID
-        linkid = link.split('/')[-2]
-        # There's just one title so yay!
-        title = et_entry.findall('{http://www.w3.org/2005/Atom}title')[0].text
-        data[linkid] = title
-    return data
-
-def nodots(data):
-    return data.replace('.', '')
-
-def detect_version(gc, s):
+    url = SPREADSHEETS_FEED
+    while url is not None:
+        r = limiter.call(get_feed_page, gc, url)
+        r.raw.decode_content = True
+        url = None
+        depth = 0
+        root = None
+        for event, elem in et.iterparse(r.raw, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth = depth + 1
+                continue
+            depth = depth - 1
+            # Only look at direct children of the feed element
+            if depth != 1:
+                continue
+            if elem.tag == ATOM_NS+'entry':
+                yield gspread.Spreadsheet(gc, elem)
+                elem.clear()
+                root.remove(elem)
+            elif elem.tag == ATOM_NS+'link' and elem.get('rel') == 'next':
+                url = elem.get('href')
+        r.close()
+
+def get_feed_page(gc, url):
     '''
-    Find a sheet called Version and something that looks like a version number in cell 1,16 (P1)
-    Else, we try to guess.
+    Start streaming a feed page with gspread's authenticated session, raising gspread errors just like it does. The
+    response is attached to them, so that ratelimit.throttle_info() sees its Retry-After header.
     '''
+    r = gc.session.requests_session.get(url, headers=gc.session.headers, stream=True)
+    if r.status_code > 399:
+        e = gspread.RequestError(r.status_code, "{0}: {1}".format(r.status_code, r.content))
+        e.response = r
+        raise e
+    return r
+
+def load_sync_state(path):
+    '''
+    Load the sync state of the previous run, i.e. for each spreadsheet id the last seen lastmodified date and the
+    outcome of processing it. Returns an empty state if there is none yet.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        debug("no sync state found, all documents will be processed")
+        return {}
 
-    # If the sheet is specifically marked as deprecated/etc, bail out now!
-    if (s.sheet1.title.lower() in ['cancelled', 'superseded', 'deprecated', 'invalid']):
-        return None
-
-    # If we're lucky there's a version number (RRA format >2.4.1)
-    version = s.sheet1.cell(1,16).value
-    if version != '':
-        return nodots(version)
-
-    # so that's when we're not so lucky.
-    #RRA 2.4.0 doesn't have the version number but has likelihood, and has a specific cell
-    #It's nearly the same as RRA 2.4.1
-    if (s.sheet1.cell(1,8).value == 'Estimated\nRisk to Mozilla'):
-        version = '2.4.0'
-        return nodots(version)
-
-    #RRA 2.3 has a specific cell as well
-    if (s.sheet1.cell(1, 8).value == 'Impact to Mozilla'):
-        version = '2.3.0'
-        return nodots(version)
-
-    #RRA 1.x has a specific cell as well - getting monotonous here!
-    if (s.sheet1.cell(1,1).value == 'Project Name' and s.sheet1.title == 'Summary'):
-        version = '1.0.0'
-        return nodots(version)
+def save_sync_state(path, state):
+    '''
+    Atomically write the sync state back to disk so that an interrupted run does not leave a truncated file behind.
+    '''
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f)
+    os.rename(tmp, path)
 
-    # Out of luck.
-    return None
+def load_post_digests(path):
+    '''
+    Load the content digests of the RRAs posted by previous runs (RRA source => rradoc.digest()), if any
+    '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        debug("no post digests found, all RRAs will be posted")
+        return {}
+
+def save_post_digests(path, digests):
+    '''Atomically write post digests back to disk'''
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dumpJSON(digests, f)
+    os.rename(tmp, path)
+
+def sync_needed(state, s):
+    '''
+    Returns True if spreadsheet @s changed since the last run (or was never seen, or its outcome may change over time)
+    @state sync state as returned by load_sync_state()
+    @s spreadsheet, as listed by list_spreadsheets()
+    '''
+    entry = state.get(s.id)
+    if entry is None or entry['updated'] != s.updated:
+        return True
+    return entry['status'] not in SYNC_FINAL
 
 def autoassign_rras(config):
     """This will search through unassigned RRA bugs and assign them automatically"""
@@ -146,7 +193,7 @@ def autoassign_rras(config):
     if len(bcfg['api_key']) == 0:
         return
 
-    b = bugzilla.Bugzilla(url=bcfg['url'], api_key=bcfg['api_key'])
+    b = bugtracker.get_client(bcfg)
 
     try:
         with open(bcfg['cache'], 'rb') as f:
@@ -164,6 +211,7 @@ def autoassign_rras(config):
     try:
         bugzilla.DotDict(bugs[-1])
         debug("Found {} unassigned RRA(s). Assigning work!".format(len(bugs)))
+        updates = []
         for bug in bugs:
             # Is this a valid rra request bug?
             if bug['whiteboard'].startswith('autoentry'):
@@ -175,11 +223,14 @@ def autoassign_rras(config):
             bug_up = bugzilla.DotDict()
             bug_up.assigned_to = assignee
             bug_up.status = 'ASSIGNED'
-            try:
-                debug("Updating bug {} assigning {}".format(bug['id'], assignee))
-                b.put_bug(bug['id'], bug_up)
-            except Exception as e:
-                debug("Failed to update bug {}: {}".format(bug['id'], e))
+            debug("Updating bug {} assigning {}".format(bug['id'], assignee))
+            updates.append((bug['id'], bug_up))
+
+        # Assignees are picked in order above, the updates themselves are sent in parallel
+        for bugid, e in b.put_bugs(updates):
+            if e is not None:
+                debug("Failed to update bug {}: {}".format(bugid, e))
+        debug("Bugzilla: {}".format(b.summary()))
 
         with open(bcfg['cache'], 'wb') as f:
             pickle.dump(assign_list, f)
@@ -187,30 +238,23 @@ def autoassign_rras(config):
     except IndexError:
         debug("No unassigned RRAs")
 
-def fill_bug(config, nags, rrajsondoc):
+def fill_bug(config, bugs, nags, rrajsondoc):
+    '''
+    Returns True if a bug was filed for the RRA, or was already open, False if it could not be reported.
+    @bugs bugtracker.AutoentryIndex, None if bugzilla is not configured
+    '''
     bcfg = config['bugzilla']
 
     # If no API key has been specified, just skip this
-    if len(bcfg['api_key']) == 0:
-        return
+    if bugs is None:
+        return False
 
-    b = bugzilla.Bugzilla(url=bcfg['url'], api_key=bcfg['api_key'])
+    b = bugs.b
 
     #Did we already report this?
-    terms = [{'product': bcfg['product']}, {'component': bcfg['component']},
-            {'creator': bcfg['creator']}, {'whiteboard': 'autoentry'},
-            {'resolution': ''},{'status': 'NEW'}, {'status': 'ASSIGNED'},
-            {'status': 'REOPENED'}, {'status': 'UNCONFIRMED'},
-            {'whiteboard': 'rra2json={}'.format(rrajsondoc.source)}
-            ]
-
-    bugs = b.search_bugs(terms)['bugs']
-    try:
-        bugzilla.DotDict(bugs[-1])
+    if bugs.get(rrajsondoc.source) is not None:
         debug("bug for {} is already present, not re-filling".format(rrajsondoc.source))
-        return
-    except IndexError:
-        pass
+        return True
 
     #If not, report now
     bug = bugzilla.DotDict()
@@ -222,33 +266,91 @@ def fill_bug(config, nags, rrajsondoc):
     if 'analyst' in rrajsondoc.details.metadata:
         bug.assigned_to = rrajsondoc.details.metadata.analyst
     try:
-        ret = b.post_bug(bug)
-        debug("Filled bug {} {}".format(rrajsondoc.source, ret))
+        ret = post_nag_bug(b, bug)
+    except Exception as e:
+        debug("Filling bug failed: {}".format(e))
+        return False
+    debug("Filled bug {} {}".format(rrajsondoc.source, ret))
+    bugs.add(rrajsondoc.source, {'id': ret.get('id'), 'whiteboard': bug.whiteboard})
+    return True
+
+def post_nag_bug(b, bug):
+    '''
+    File @bug, unassigned if its assignee has no bugzilla account. Returns what b.post_bug() returns, raises if the
+    bug could not be filed.
+    @b bugzilla.Bugzilla
+    '''
+    try:
+        return b.post_bug(bug)
     except Exception as e:
         # Code 51 = assigned_to user does not exist, just assign to default then
-        url, estr, ecode, edict = e.args
-        if edict['code'] == 51: 
+        if 'assigned_to' in bug and len(e.args) == 4 and e.args[3].get('code') == 51:
             del bug.assigned_to
-            try:
-                ret = b.post_bug(bug)
-                debug("Filled bug {} {}".format(rrajsondoc.source, ret))
-            except Exception as e1:
-                debug("Filling bug failed: {}".format(e1))
-        else:
-            debug("Filling bug failed: {}".format(e))
+            return b.post_bug(bug)
+        raise
 
-def verify_fields_and_nag(config, rrajsondoc):
+def fill_digest_bugs(config, bugs, digest):
+    '''
+    File one bug per recipient of @digest, listing the nags of all their RRAs. If the digest bug of a recipient filed
+    by a previous run is still open, RRAs it does not list yet are added to it as a comment instead.
+    Returns the sources of the RRAs whose nags could not be reported.
+    @bugs bugtracker.AutoentryIndex
+    @digest bugtracker.NagDigest
+    '''
+    bcfg = config['bugzilla']
+    b = bugs.b
+    failed = []
+
+    for recipient, entries in digest.recipients.items():
+        key = digest.key(recipient)
+        existing = bugs.get_digest(key)
+        try:
+            if existing is not None:
+                listed = bugs.digest_sources(key)
+                entries = [entry for entry in entries if entry[0] not in listed]
+                if len(entries) == 0:
+                    debug("Nag digest bug {} of {} already lists all their RRAs".format(existing['id'], key))
+                    continue
+                b.post_comment(existing['id'], digest.text(entries))
+                listed.update([source for source, service, nags in entries])
+                debug("Updated nag digest bug {} of {}: {} RRA(s)".format(existing['id'], key, len(entries)))
+                continue
+
+            bug = bugzilla.DotDict()
+            bug.product = bcfg['product']
+            bug.component = bcfg['component']
+            bug.summary = "There are issues with {} RRA(s) of {}".format(len(entries), recipient or key)
+            bug.description = digest.text(entries)
+            bug.whiteboard = 'autoentry rra2json-digest={}'.format(key)
+            # Owners are not always bugzilla accounts
+            if '@' in recipient:
+                bug.assigned_to = recipient
+            ret = post_nag_bug(b, bug)
+            debug("Filled nag digest bug of {}: {} RRA(s) {}".format(key, len(entries), ret))
+            bugs.add_digest(key, {'id': ret.get('id'), 'whiteboard': bug.whiteboard},
+                    [source for source, service, nags in entries])
+        except Exception as e:
+            debug("Filling nag digest bug of {} failed: {}".format(key, e))
+            failed.extend([source for source, service, nags in entries])
+    return failed
+
+def verify_fields_and_nag(config, rrajsondoc, bugs=None, digest=None):
     """
     If the RRA has not been touched for a certain about of days (configurable), and some critical fields are missing,
     create a notification with the list of nags for the users to fix it.
     More nags can be added to the list, and should be inside a dict. See the "risk record" nag below for example.
-    returns True if RRA can be posted, False if it cannot or should not (for ex missing fields, or exempt)
+    returns 'post' if RRA can be posted, 'pending' if it cannot be posted yet (missing fields, but it's too early to
+    nag, or the notification could not be created, so that it's looked at again on the next run), 'nagged' if it
+    cannot be posted and a notification was created, or 'nonag' if it cannot be posted and nagging is disabled.
+    @bugs bugtracker.AutoentryIndex, see fill_bug()
+    @digest bugtracker.NagDigest: if set, nags are added to it to be reported at the end of the run, see
+    fill_digest_bugs()
     """
     nags = []
 
     # Only version 250+ supports fields that we check and nag for
     if int(rrajsondoc.details.metadata.RRA_version) < 250:
-        return True
+        return 'post'
 
     # Having a risk record is required.
     if (len(rrajsondoc.details.metadata.risk_record) < 2):
@@ -263,7 +365,11 @@ def verify_fields_and_nag(config, rrajsondoc):
         nags.append({"title": "There is no service name", "body": "Please add a service name to the RRA at https://docs.google.com/spreadsheets/d/{}".format(rrajsondoc.source)})
 
     if len(nags) == 0:
-        return True
+        return 'post'
+    elif bugs is None:
+        # We only know how to notify via bugzilla bugs right now, and it's not configured: there's nothing more to do
+        # until the RRA changes (or use --full-sync once it's configured)
+        return 'nonag'
     else:
         # Only start nagging after X days without update
         dt_now = parselib.toUTC()
@@ -271,17 +377,26 @@ def verify_fields_and_nag(config, rrajsondoc):
         delta = dt_now-dt_updated
 
         if (delta.days < config['rra2json']['days_before_nag']):
-            return False
+            return 'pending'
         # We only know how to notify via bugzilla bugs right now
-        fill_bug(config, nags, rrajsondoc)
-        return False
+        if digest is not None:
+            if bugs.get(rrajsondoc.source) is not None:
+                debug("bug for {} is already present, not adding it to the nag digest".format(rrajsondoc.source))
+            else:
+                digest.add(rrajsondoc, nags)
+            return 'nagged'
+        if not fill_bug(config, bugs, nags, rrajsondoc):
+            return 'pending'
+        return 'nagged'
 
-def main(config):
+def main(config, full_sync=False, from_dir=None, replay_dlq=False, force_post=False, post=False):
+    '''
+    Returns the number of RRAs that could not be sent to service-map.
+    @post with @from_dir, post and nag as configured rather than only printing RRAs, see replay_snapshots()
+    '''
     rra2jsonconfig = config['rra2json']
-    authconfig = config['oauth2']
-    rrajson_skel = config['rrajson']
-    data_levels = config['data_levels']
-    risk_levels = config['risk_levels']
+    # Replaying snapshots is a dry run unless asked otherwise: nothing is posted, nagged about or recorded
+    dry_run = from_dir is not None and not post and not replay_dlq
 
     #Disable debugging messages by assigning a null/none function, if configured to do so.
     if rra2jsonconfig['debug'] != 'true':
@@ -289,59 +404,350 @@ def main(config):
     else:
         debug = globals()['debug']
 
+    # Parsers for all supported RRA versions, resolved once
+    parsers = rra_parsers.build_registry()
+    parselib.configure_levels(config['risk_levels'], config.get('level_aliases', {}))
+
+    # Where labels were last found in each RRA template version, so that they're usually not searched for
+    anchors_path = rra2jsonconfig.get('anchors', '')
+    if len(anchors_path) > 0:
+        rra_parsers.engine.load_anchors(anchors_path)
+
+    # Single service-map client for the whole run, so that connections are reused. RRAs that could not be sent are
+    # kept on disk, see --replay-dlq
+    dlq_path = config['servicemap'].get('dead_letter', '')
+    dlq = None
+    if len(dlq_path) > 0 and not dry_run:
+        dlq = deadletter.DeadLetterQueue(dlq_path)
+    # RRAs are only posted if their content changed since they were last posted, unless forced to
+    digests_path = rra2jsonconfig.get('post_digests', '')
+    digests = {}
+    if len(digests_path) > 0 and not dry_run:
+        digests = load_post_digests(digests_path)
+    smap = servicemap.ServiceMap(config['servicemap'], dlq, digests, force_post)
+
+    try:
+        if replay_dlq:
+            return replay_dead_letters(smap, debug)
+        # Offline replay of exported snapshots: no Google access and no sync state, every snapshot is processed.
+        if dry_run:
+            replay_snapshots(config, parsers, smap, from_dir, False, debug)
+            failures = 0
+        elif from_dir is not None:
+            replay_snapshots(config, parsers, smap, from_dir, True, debug)
+            failures = finish_posting(smap, {}, debug)
+        else:
+            failures = sync_drive(config, parsers, smap, full_sync, debug)
+        log_parse_stats(debug)
+        return failures
+    finally:
+        smap.close()
+        bugtracker.close_clients()
+        if len(digests_path) > 0 and not dry_run:
+            save_post_digests(digests_path, smap.digests)
+        if len(anchors_path) > 0:
+            rra_parsers.engine.save_anchors(anchors_path)
+
+def replay_snapshots(config, parsers, smap, path, post, debug):
+    '''
+    Process all snapshots of directory @path. Grids are local, so parsing can be spread over parse_workers
+    processes. If @post, documents are then verified and posted by the pipeline, see document_stages(). Otherwise
+    they're only printed as JSON, one per line.
+    '''
+    rra2jsonconfig = config['rra2json']
+    snapshots = sheetgrid.load_snapshots(path)
+    stages = document_stages(config, parsers, smap, None, debug)
+    p = pipeline.Pipeline(rra2jsonconfig.get('queue_size', 8))
+
+    workers = rra2jsonconfig.get('parse_workers', 1)
+    if workers < 2:
+        jobs = (new_job(s, s.title) for s in snapshots)
+        p.add('parse', stages['parse'])
+    else:
+        def parsed_jobs():
+            results = parsepool.parse_snapshots(snapshots, config['rrajson'], config['data_levels'],
+                    config['risk_levels'], config.get('level_aliases', {}), workers,
+                    rra2jsonconfig.get('parse_chunk_size', 16))
+            for s, status, rra_version, rrajsondoc, tb in results:
+                job = new_job(s, s.title)
+                # When re-processing many documents, a parser bug in one of them should not stop the others
+                if status == 'error':
+                    sys.stderr.write(tb)
+                    job['log'].append('Exception occured while parsing RRA {} - id {}'.format(s.title, s.id))
+                    job['done'] = True
+                else:
+                    parsed(job, status, rra_version, rrajsondoc)
+                yield job
+        jobs = parsed_jobs()
+    if not post:
+        for job in run_pipeline(p, jobs, debug):
+            if not job['done']:
+                print(job['doc'].to_json())
+        return
+    p.add('verify', stages['verify']).add('post', stages['post'])
+
+    for job in run_pipeline(p, jobs, debug):
+        pass
+    stages['finish']()
+
+def replay_dead_letters(smap, debug):
+    '''
+    Send RRAs from the dead-letter queue again, as they were when they failed: nothing is fetched from Google.
+    They're removed from the queue once posted. Returns the number of RRAs that still could not be sent.
+    '''
+    if smap.dlq is None:
+        fatal('No dead-letter queue configured (servicemap.dead_letter)')
+    debug('Replaying {} RRA(s) from the dead-letter queue'.format(len(smap.dlq)))
+    for fname, payload in smap.dlq.items():
+        try:
+            doc = json.loads(payload)
+            source = doc['source']
+        except (ValueError, KeyError):
+            debug('Ignoring invalid dead-letter file {}'.format(fname))
+            continue
+        digest = rradoc.digest(doc)
+        if smap.bulk:
+            smap.queue(source, payload, digest)
+        else:
+            smap.send(source, payload, digest)
+    return finish_posting(smap, {}, debug)
+
+def sync_drive(config, parsers, smap, full_sync, debug):
+    rra2jsonconfig = config['rra2json']
+    authconfig = config['oauth2']
+
     gc = gspread_authorize(authconfig['client_email'], authconfig['private_key'], authconfig['spread_scope'])
 
     if not gc:
         fatal('Authorization failed')
 
-    # Looking at the XML feed is the only way to get sheet document title for some reason.
-    sheets = get_sheet_titles(gc)
-    # Do not traverse sheets manually, it's very slow due to the API delays.
-    # Opening all at once, including potentially non-useful sheet is a zillion times faster as it's a single API call.
-    gsheets = gc.openall()
-    for s in gsheets:
-        rra_version = detect_version(gc, s)
-        if rra_version != None:
-            # Virtual function pointer with JIT module import
-            try:
-                parse_module = 'parse_{}'.format(rra_version)
-                m = __import__('rra_parsers', globals(), locals(), [parse_module])
-                parse_rra = getattr(getattr(m, parse_module), 'parse_rra')
-            except (KeyError, UnboundLocalError, AttributeError) as e:
-                # If this error is reached, you want to add a new parse_rra_... function that will parse the new format!
-                debug("Unsupported RRA version {}. rra2json needs to add explicit support before it can be parsed. Skipping RRA {} - id {}.".format(rra_version, sheets[s.id], s.id))
-                continue
+    # Sync state lets us skip documents that did not change since the last run. It's always updated, even on a full
+    # sync, so that the next run can be incremental again.
+    sync_state_path = rra2jsonconfig.get('sync_state', '')
+    if len(sync_state_path) > 0:
+        sync_state = load_sync_state(sync_state_path)
+    else:
+        sync_state = {}
 
-            try:
-                rrajsondoc = parse_rra(gc, s, sheets[s.id], rra_version, DotDict(dict(copy.deepcopy(rrajson_skel))), list(data_levels),
-                        list(risk_levels))
-                if rrajsondoc == None:
-                    debug('Document {} ({}) could not be parsed and is probably not an RRA'.format(sheets[s.id], s.id))
-                    continue
+    try:
+        return process_sheets(config, parsers, smap, gc, sync_state, full_sync, debug)
+    finally:
+        if len(sync_state_path) > 0:
+            save_sync_state(sync_state_path, sync_state)
 
-                # Set RRA version outside of processing functions to ensure it's always set properly, regardless of how
-                # parsing is done.
-                rrajsondoc.details.metadata.RRA_version = rra_version
-            except:
-                import traceback
-                traceback.print_exc()
-                debug('Exception occured while parsing RRA {} - id {}'.format(sheets[s.id], s.id))
-                sys.exit(1)
-            else:
-                if rra2jsonconfig['debug_level'] > 1:
-                    import pprint
-                    pp = pprint.PrettyPrinter()
-                    pp.pprint(rrajsondoc)
-                success = verify_fields_and_nag(config, rrajsondoc)
-                if success:
-                    if rra2jsonconfig['debug_level'] < 2:
-                        post_rra_to_servicemap(config['servicemap'], rrajsondoc)
-                    else:
-                        debug('Not posting RRA - debug mode')
-
-            debug('Parsed {}: {}'.format(sheets[s.id], rra_version))
-        else:
-            debug('Document {} ({}) could not be parsed and is probably not an RRA (no version detected)'.format(sheets[s.id], s.id))
+def new_job(s, name, spreadsheet=None):
+    '''
+    A document going through the pipeline, see document_stages(). status is what happened to it so far (see
+    process_sheets()), and done is set once nothing more is to be done with it. Messages about the document are kept
+    in log, and only logged once it's out of the pipeline, so that they're in the same order whatever the stages are
+    up to.
+    @s sheetgrid.SpreadsheetGrid or sheetgrid.SnapshotGrid, or None until fetched
+    @name spreadsheet name
+    @spreadsheet gspread.models.Spreadsheet, when fetching from Google
+    '''
+    return {'id': s.id if s is not None else spreadsheet.id, 'name': name, 'spreadsheet': spreadsheet, 'grid': s,
+            'status': None, 'version': None, 'doc': None, 'done': False, 'log': []}
+
+def parsed(job, status, rra_version, rrajsondoc):
+    '''Record the outcome of rra_parsers.parse_document() in @job'''
+    job['status'] = status
+    job['version'] = rra_version
+    job['doc'] = rrajsondoc
+    # Grids are large, and not needed past this point
+    job['grid'] = None
+    if status == 'notrra' and rra_version is None:
+        job['log'].append('Document {} ({}) could not be parsed and is probably not an RRA (no version detected)'.format(job['name'], job['id']))
+        job['done'] = True
+    elif status == 'unsupported':
+        # If this is reached, you want to add a field map or a parse_... module that will parse the new format!
+        job['log'].append("Unsupported RRA version {}. rra2json needs to add explicit support before it can be parsed. Skipping RRA {} - id {}.".format(rra_version, job['name'], job['id']))
+        job['done'] = True
+    elif status == 'notrra':
+        job['log'].append('Document {} ({}) could not be parsed and is probably not an RRA'.format(job['name'], job['id']))
+        job['done'] = True
+
+def document_stages(config, parsers, smap, gc, debug, limiter=None, cache=None):
+    '''
+    Pipeline stage functions, by name. Each takes a job (see new_job()) and passes it on, jobs that are done go
+    through the remaining stages untouched:
+    - fetch: fetch the first worksheet from Google (network)
+    - parse: detect the version of, and parse the document (CPU, and network for RRA 1.x second worksheet)
+    - verify: verify_fields_and_nag() (network, when nagging)
+    - post: post_rra_to_servicemap() (network)
+    And 'finish', to be called once all documents went through the pipeline. It reports nags collected in nag_digest
+    mode, and returns the sources of RRAs whose nags could not be reported.
+    @parsers rra_parsers.build_registry() output
+    @smap servicemap.ServiceMap
+    @gc google gspread connection (None when replaying snapshots)
+    @limiter, @cache see sheetgrid.SpreadsheetGrid
+    '''
+    rra2jsonconfig = config['rra2json']
+    bcfg = config['bugzilla']
+
+    # Open bugs filed by previous runs, fetched at most once for the whole run
+    bugs = None
+    if len(bcfg['api_key']) > 0:
+        bugs = bugtracker.AutoentryIndex(bugtracker.get_client(bcfg), bcfg)
+    # Nags of the whole run, reported with one bug per analyst/owner
+    digest = None
+    if bugs is not None and bcfg.get('nag_digest', 'false') == 'true':
+        digest = bugtracker.NagDigest()
+
+    def fetch(job):
+        gs = job['spreadsheet']
+        try:
+            s = sheetgrid.SpreadsheetGrid(gs, limiter, cache)
+            s.sheet1
+        except Exception as e:
+            job['log'].append('Failed to fetch document {} ({}), will retry on next run: {}'.format(gs.title, gs.id, e))
+            job['done'] = True
+            return job
+        job['grid'] = s
+        return job
+
+    def parse(job):
+        if job['done']:
+            return job
+        try:
+            status, rra_version, rrajsondoc = rra_parsers.parse_document(parsers, gc, job['grid'], job['name'],
+                    config['rrajson'], config['data_levels'], config['risk_levels'])
+        except Exception:
+            # A parser bug in one document should not stop the others, nor lose the ones before it that are still
+            # in the pipeline. It's parsed again on the next run.
+            import traceback
+            traceback.print_exc()
+            job['log'].append('Exception occured while parsing RRA {} - id {}'.format(job['name'], job['id']))
+            job['done'] = True
+            return job
+        parsed(job, status, rra_version, rrajsondoc)
+        return job
+
+    def verify(job):
+        if job['done']:
+            return job
+        if rra2jsonconfig['debug_level'] > 1:
+            import pprint
+            pp = pprint.PrettyPrinter()
+            pp.pprint(job['doc'].to_dict())
+        job['status'] = verify_fields_and_nag(config, job['doc'], bugs, digest)
+        if job['status'] != 'post':
+            job['done'] = True
+        elif rra2jsonconfig['debug_level'] > 1:
+            job['log'].append('Not posting RRA - debug mode')
+            job['status'] = None
+            job['done'] = True
+        job['log'].append('Parsed {}: {}'.format(job['name'], job['version']))
+        return job
+
+    def post(job):
+        if job['done']:
+            return job
+        job['status'] = post_rra_to_servicemap(smap, job['doc'])
+        job['done'] = True
+        return job
+
+    def finish():
+        if digest is None or len(digest) == 0:
+            return []
+        debug('Reporting nags of {} RRA(s) to {} recipient(s)'.format(len(digest), len(digest.recipients)))
+        return fill_digest_bugs(config, bugs, digest)
+
+    return {'fetch': fetch, 'parse': parse, 'verify': verify, 'post': post, 'finish': finish}
+
+def run_pipeline(p, jobs, debug):
+    '''
+    Yields jobs once done, logging how many jobs wait in front of each stage every PIPELINE_LOG_EVERY jobs, and how
+    long each stage took once all are done.
+    @p pipeline.Pipeline
+    '''
+    count = 0
+    for job in p.run(jobs):
+        count = count + 1
+        for msg in job['log']:
+            debug(msg)
+        if count % PIPELINE_LOG_EVERY == 0:
+            debug('Pipeline queues after {} document(s): {}'.format(count, ', '.join(['{} {}'.format(name, depth)
+                for name, depth in p.depths()])))
+        yield job
+    debug('Pipeline: {}'.format(p.summary()))
+
+def process_sheets(config, parsers, smap, gc, sync_state, full_sync, debug):
+    '''
+    Process all documents that changed since the last run, and record what happened to each in @sync_state:
+    'notrra', 'unsupported', 'pending', 'nagged', 'nonag', 'posted', 'unchanged', 'postfailed', or None if it could not
+    be fetched or parsed, or was parsed but not posted because of the debug settings.
+    Returns the number of RRAs that could not be sent to service-map.
+    '''
+    rra2jsonconfig = config['rra2json']
+
+    # Every Google API call goes through the limiter, so that we go as fast as the quota allows but no faster.
+    concurrency = rra2jsonconfig.get('concurrency', 1)
+    rlcfg = rra2jsonconfig.get('rate_limit', {})
+    limiter = ratelimit.RateLimiter(rate=rlcfg.get('rate', 10), burst=rlcfg.get('burst', 10),
+            max_concurrency=concurrency, retries=rlcfg.get('retries', 5), backoff=rlcfg.get('backoff', 1.0))
+
+    # Grids of unchanged documents are read back from disk instead of being fetched again, e.g. when re-running after
+    # a parser fix or a crash.
+    if len(rra2jsonconfig.get('grid_cache', '')) > 0:
+        cache = gridcache.GridCache(rra2jsonconfig['grid_cache'], rra2jsonconfig.get('grid_cache_size', 100)*1024*1024)
+    else:
+        cache = None
+
+    # The listing is streamed: documents start being fetched and processed while it is still going on.
+    counts = collections.Counter()
+    def changed_spreadsheets():
+        for gs in list_spreadsheets(gc, limiter):
+            counts['listed'] = counts['listed'] + 1
+            if not full_sync and not sync_needed(sync_state, gs):
+                counts['skipped'] = counts['skipped'] + 1
+                continue
+            yield new_job(None, gs.title, gs)
+
+    # Listing, fetching, parsing, verifying and posting all overlap. Worksheets are fetched once and shared between
+    # version detection and parsing, by a pool of workers as it's mostly waiting on the network. Documents still go
+    # through the next stages in listing order, see pipeline.Pipeline. Parsing, nagging and posting are done one
+    # document at a time, as the parsers' statistics, bugzilla and servicemap.ServiceMap are not shared between
+    # threads.
+    stages = document_stages(config, parsers, smap, gc, debug, limiter, cache)
+    p = pipeline.Pipeline(rra2jsonconfig.get('queue_size', 8))
+    p.add('fetch', stages['fetch'], concurrency)
+    for name in ['parse', 'verify', 'post']:
+        p.add(name, stages[name])
+    for job in run_pipeline(p, changed_spreadsheets(), debug):
+        sync_state[job['id']] = {'updated': job['spreadsheet'].updated, 'status': job['status']}
+    # Try again on the next run
+    for source in stages['finish']():
+        if source in sync_state:
+            sync_state[source]['status'] = 'pending'
+
+    debug('Listed {} document(s), skipped {} unchanged document(s)'.format(counts['listed'], counts['skipped']))
+    debug('Google API: {}'.format(limiter.summary()))
+    if cache is not None:
+        debug('Grid cache: {}'.format(cache.summary()))
+    return finish_posting(smap, sync_state, debug)
+
+def finish_posting(smap, sync_state, debug):
+    '''
+    Send the last batch of RRAs, if batching, and report RRAs that could not be posted. These are marked as
+    'postfailed' in @sync_state so that they're processed again on the next run.
+    Returns the number of RRAs that could not be posted.
+    '''
+    smap.flush()
+    for source, error in smap.failed.items():
+        debug('Failed to send RRA {} to servicemap: {}'.format(source, error))
+        if source in sync_state:
+            sync_state[source]['status'] = 'postfailed'
+    debug('Service-map: {}'.format(smap.summary()))
+    if smap.dlq is not None and len(smap.dlq) > 0:
+        debug('{} RRA(s) in the dead-letter queue, see --replay-dlq'.format(len(smap.dlq)))
+    return len(smap.failed)
+
+def log_parse_stats(debug):
+    '''Report how labels were found: known positions vs grid searches, and fields that were found under fallback
+    labels, so that field maps can follow template changes'''
+    debug('Labels: {}'.format(rra_parsers.engine.anchor_summary()))
+    for line in rra_parsers.engine.drift_summary():
+        debug('Template drift: {}'.format(line))
 
 if __name__ == "__main__":
     #Load defaults, config
@@ -356,13 +762,26 @@ if __name__ == "__main__":
     #Parse arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("-a", "--assign-rras", help="autoassign pending rras only (no rra conversion, etc. done)", action="store_true")
+    parser.add_argument("-f", "--full-sync", help="process all documents, even if they did not change since the last run", action="store_true")
+    parser.add_argument("-l", "--list-parsers", help="list supported RRA versions and how each is parsed, then exit", action="store_true")
+    parser.add_argument("-d", "--from-dir", help="process exported JSON/CSV snapshots from this directory instead of Google Drive, and print the RRAs as JSON (see --post)")
+    parser.add_argument("-r", "--replay-dlq", help="send RRAs from the dead-letter queue to servicemap again, then exit", action="store_true")
+    parser.add_argument("-P", "--post", help="with --from-dir, post RRAs to servicemap and nag as configured instead of only printing them", action="store_true")
+    parser.add_argument("-p", "--force-post", help="post RRAs to servicemap even if they did not change since they were last posted", action="store_true")
     args = parser.parse_args()
 
-    if args.assign_rras:
+    if args.list_parsers:
+        parsers = rra_parsers.build_registry()
+        for version in sorted(parsers):
+            print('{}\t{}'.format(version, parsers[version][1]))
+    elif args.assign_rras:
         # Use this opportunity to do some house keeping!
         if len(config['bugzilla']['autoassign']) == 0:
             debug("Notice, autoassign option is disabled")
         else:
             autoassign_rras(config)
     else:
-        main(config)
+        # Exit status 2 means the run went through, but some RRAs could not be sent to servicemap
+        if main(config, full_sync=args.full_sync, from_dir=args.from_dir, replay_dlq=args.replay_dlq,
+                force_post=args.force_post, post=args.post) > 0:
+            sys.exit(2)
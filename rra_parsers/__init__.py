@@ -0,0 +1,133 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+# RRA parsers, by RRA version:
+#  - versions described in fieldmaps.FIELD_MAPS are parsed by the generic engine
+#  - parse_<version>.py modules provide a hand written parse_rra() for versions that the field maps can't describe
+#  - ALIASES lists versions that are parsed exactly like another version
+# build_registry() puts these together once at startup.
+
+import importlib
+import pkgutil
+import rradoc
+from rra_parsers import engine
+from rra_parsers.fieldmaps import FIELD_MAPS
+
+# RRA version => version it's parsed as
+ALIASES = {
+    '240': '241',
+    '242': '241',
+    '244': '243',
+    '245': '243',
+}
+
+class FieldMapParser(object):
+    '''
+    parse_rra() function for a version of FIELD_MAPS. The extraction plan is compiled when the parser is created,
+    so that a broken field map fails at startup rather than on the first RRA of that version.
+    '''
+    def __init__(self, version):
+        self.version = version
+        engine.get_plan(version)
+
+    def __call__(self, gc, sheet, name, version, rrajson, data_levels, risk_levels):
+        return engine.parse_rra(sheet, self.version, rrajson, data_levels, risk_levels)
+
+def build_registry():
+    '''
+    Returns {RRA version: (parse_rra function, description)} for all supported RRA versions.
+    parse_rra(gc, sheet, name, version, rrajson, data_levels, risk_levels) returns the parsed rrajson, or None.
+    '''
+    registry = {}
+    for version in FIELD_MAPS:
+        registry[version] = (FieldMapParser(version), 'field map {}'.format(version))
+
+    for finder, name, ispkg in pkgutil.iter_modules(__path__):
+        if not name.startswith('parse_'):
+            continue
+        m = importlib.import_module('rra_parsers.{}'.format(name))
+        registry[name[len('parse_'):]] = (m.parse_rra, 'module {}'.format(name))
+
+    for version, target in ALIASES.items():
+        parse_rra, description = registry[target]
+        registry[version] = (parse_rra, '{} (alias of {})'.format(description, target))
+
+    return registry
+
+def nodots(data):
+    return data.replace('.', '')
+
+def detect_version(gc, s):
+    '''
+    Find a sheet called Version and something that looks like a version number in cell 1,16 (P1)
+    Else, we try to guess.
+    @s sheetgrid.SpreadsheetGrid: all cells are read from the same, single fetch of the first worksheet
+    '''
+    sheet1 = s.sheet1
+
+    # If the sheet is specifically marked as deprecated/etc, bail out now!
+    if (sheet1.title.lower() in ['cancelled', 'superseded', 'deprecated', 'invalid']):
+        return None
+
+    # If we're lucky there's a version number (RRA format >2.4.1)
+    version = sheet1.value(1,16)
+    if version != '':
+        return nodots(version)
+
+    # so that's when we're not so lucky.
+    #RRA 2.4.0 doesn't have the version number but has likelihood, and has a specific cell
+    #It's nearly the same as RRA 2.4.1
+    if (sheet1.value(1,8) == 'Estimated\nRisk to Mozilla'):
+        version = '2.4.0'
+        return nodots(version)
+
+    #RRA 2.3 has a specific cell as well
+    if (sheet1.value(1, 8) == 'Impact to Mozilla'):
+        version = '2.3.0'
+        return nodots(version)
+
+    #RRA 1.x has a specific cell as well - getting monotonous here!
+    if (sheet1.value(1,1) == 'Project Name' and sheet1.title == 'Summary'):
+        version = '1.0.0'
+        return nodots(version)
+
+    # Out of luck.
+    return None
+
+def parse_document(parsers, gc, s, name, skel, data_levels, risk_levels):
+    '''
+    Detect the version of and parse a single document.
+    Returns (status, RRA version, rradoc.RRADocument) where status is:
+     - 'notrra': no version detected (RRA version is None), or the parser found nothing to parse
+     - 'unsupported': no parser for that version
+     - 'parsed': the document is set
+    Parser exceptions are not caught.
+    @parsers build_registry() output
+    @gc google gspread connection (None when replaying snapshots)
+    @s sheetgrid.SpreadsheetGrid or sheetgrid.SnapshotGrid
+    @name spreadsheet name
+    @skel "rrajson" configuration, see rradoc.RRADocument.from_skeleton()
+    '''
+    rra_version = detect_version(gc, s)
+    if rra_version == None:
+        return 'notrra', None, None
+
+    try:
+        parse_rra = parsers[rra_version][0]
+    except KeyError:
+        return 'unsupported', rra_version, None
+
+    rrajsondoc = parse_rra(gc, s, name, rra_version, rradoc.RRADocument.from_skeleton(skel), list(data_levels),
+            list(risk_levels))
+    if rrajsondoc == None:
+        return 'notrra', rra_version, None
+
+    # Set RRA version outside of processing functions to ensure it's always set properly, regardless of how
+    # parsing is done.
+    rrajsondoc.details.metadata.RRA_version = rra_version
+    return 'parsed', rra_version, rrajsondoc
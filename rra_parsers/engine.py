@@ -0,0 +1,255 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+# Generic RRA parser, driven by the per-version field maps of fieldmaps.py
+# A field map is compiled once per version into an extraction plan (flat list of steps with their fallbacks and
+# validators resolved), which is then run against the indexed grid of each RRA of that version.
+
+import os
+import json
+import collections
+from parselib import *
+from rra_parsers.fieldmaps import FIELD_MAPS
+
+# Field which, when empty, means the sheet isn't filled in yet and there's nothing to parse
+SERVICE_FIELD = 'details.metadata.service'
+
+VALIDATORS = {
+    'risk': lambda value, risk_levels: validate_entry(value, risk_levels),
+    'data_level': lambda value, risk_levels: normalize_data_level(value),
+    'team': lambda value, risk_levels: fuzzy_find_team_name(value),
+    'comma': lambda value, risk_levels: comma_tokenizer(value),
+}
+
+_plans = {}
+
+# (version, field, label index, label) => how many RRAs had that field under that label, see drift_summary()
+label_stats = collections.Counter()
+
+# RRA version => {label: [row, col]} where that label was last found, see locate()
+anchors = {}
+anchor_stats = collections.Counter()
+
+def field_map(version):
+    '''
+    Returns the field map of @version with its base versions merged in
+    '''
+    fmap = FIELD_MAPS[version]
+    if 'base' in fmap:
+        res = field_map(fmap['base'])
+    else:
+        res = {'fields': {}, 'data_dictionary': None, 'recommendations': None}
+
+    for path, spec in fmap['fields'].items():
+        if spec is None:
+            res['fields'].pop(path, None)
+        else:
+            res['fields'][path] = spec
+    for k in ['data_dictionary', 'recommendations']:
+        if k in fmap:
+            res[k] = fmap[k]
+    return res
+
+def compile_plan(version):
+    '''
+    Compile the field map of @version into an extraction plan:
+    {'steps': [(path, (label, ...), [(xmoves, ymoves), ...], validator function or None), ...],
+     'data_dictionary': ..., 'recommendations': ...}
+    The service name step always comes first, the other steps are sorted by path.
+    '''
+    fmap = field_map(version)
+    steps = []
+    for path in sorted(fmap['fields'], key=lambda p: (p != SERVICE_FIELD, p)):
+        label, xmoves, ymoves, validator, fallbacks = fmap['fields'][path]
+        labels = [label]
+        offsets = [(xmoves, ymoves)]
+        for fallback in fallbacks:
+            if isinstance(fallback, tuple):
+                labels.append(fallback[0])
+                offsets.append(fallback[1:])
+            else:
+                labels.append(fallback)
+                offsets.append((xmoves, ymoves))
+        labels = tuple(labels)
+        if validator is not None and validator not in VALIDATORS:
+            raise ValueError('Unknown validator {} for {} in RRA version {}'.format(validator, path, version))
+        steps.append((path.split('.'), labels, offsets, VALIDATORS.get(validator)))
+
+    if not steps or steps[0][0] != SERVICE_FIELD.split('.'):
+        raise ValueError('RRA version {} has no {} field'.format(version, SERVICE_FIELD))
+
+    return {'steps': steps, 'data_dictionary': fmap['data_dictionary'], 'recommendations': fmap['recommendations']}
+
+def get_plan(version):
+    '''Cached compile_plan()'''
+    try:
+        return _plans[version]
+    except KeyError:
+        _plans[version] = compile_plan(version)
+        return _plans[version]
+
+def load_anchors(path):
+    '''Load anchors saved by a previous run, if any'''
+    try:
+        with open(path) as f:
+            anchors.update(json.load(f))
+    except (IOError, OSError, ValueError):
+        pass
+
+def save_anchors(path):
+    '''Atomically write anchors back to disk'''
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dump(anchors, f)
+    os.rename(tmp, path)
+
+def locate(sheet_data, version, labels):
+    '''
+    find_label(), but first checking whether @labels[0] is where it was in the last RRA of @version. Templates are
+    fixed per version, so this usually only compares the cells up to that position and the grid doesn't need to be
+    indexed or searched at all. Whenever @labels[0] is searched for and found, its position is remembered for the
+    next RRA. Fallback labels are not: they're only used when @labels[0] isn't in the grid at all, which can't be
+    told without searching.
+    '''
+    known = anchors.setdefault(version, {})
+    pos = known.get(labels[0])
+    if pos is not None:
+        try:
+            if normalize_label(sheet_data[pos[0]][pos[1]]) == labels[0].lower() and \
+                    first_occurrence(sheet_data, labels[0].lower(), pos):
+                anchor_stats['hits'] += 1
+                return 0, pos
+        except IndexError:
+            pass
+
+    anchor_stats['searches'] += 1
+    i, pos = find_label(sheet_data, labels)
+    if i == 0:
+        known[labels[0]] = list(pos)
+    return i, pos
+
+def first_occurrence(sheet_data, label, pos):
+    '''
+    Returns True if normalized @label is not found before @pos in reading order, as parsers always use the first
+    occurrence of a label. Only the cells before @pos are looked at, and a SheetIndex is not indexed.
+    '''
+    for x in range(pos[0]+1):
+        cells = sheet_data[x]
+        if x == pos[0]:
+            cells = cells[:pos[1]]
+        for item in cells:
+            if normalize_label(item) == label:
+                return False
+    return True
+
+def anchor_summary():
+    return '{} found at their known position, {} searched for'.format(anchor_stats['hits'], anchor_stats['searches'])
+
+def extract(sheet_data, version, labels, offsets, found):
+    '''
+    Returns (value, index of the label found) for the first of @labels found in @sheet_data, read at the matching
+    @offsets from it.
+    @found labels => locate() result of the RRA being parsed, as many fields share the same labels
+    Raises IndexError if none are found.
+    '''
+    try:
+        i, pos = found[labels]
+    except KeyError:
+        i, pos = found[labels] = locate(sheet_data, version, labels)
+    xmoves, ymoves = offsets[i]
+    return cell_at(sheet_data, pos, xmoves, ymoves), i
+
+def set_field(rrajson, path, value):
+    obj = rrajson
+    for k in path[:-1]:
+        obj = getattr(obj, k)
+    setattr(obj, path[-1], value)
+
+def parse_rra(sheet, version, rrajson, data_levels, risk_levels):
+    '''
+    Parse the RRA in @sheet according to the field map of @version
+    @sheet spreadsheet
+    @version RRA version, key of FIELD_MAPS
+    @rrajson writable template for the JSON format of the RRA
+    @data_levels list of data levels allowed
+    @risk_levels list of risk levels allowed
+    Returns @rrajson, or None if the RRA has no service name yet.
+    '''
+    plan = get_plan(version)
+
+    s = sheet.sheet1
+    #Fetch/export all data for faster processing
+    #Format is sheet_data[row][col] with positions starting at 0, i.e.:
+    #cell(1,2) is sheet_data[0,1]
+    sheet_data = s.get_all_values()
+
+    rrajson.source = sheet.id
+
+    found = {}
+    for path, labels, offsets, validator in plan['steps']:
+        value, i = extract(sheet_data, version, labels, offsets, found)
+        label_stats[(version, '.'.join(path), i, labels[i])] += 1
+        if validator is not None:
+            value = validator(value, risk_levels)
+        set_field(rrajson, path, value)
+        if path == plan['steps'][0][0] and len(value) == 0:
+            return None
+
+    rrajson.summary = 'RRA for {}'.format(rrajson.details.metadata.service)
+    rrajson.timestamp = toUTC(datetime.now()).isoformat()
+    rrajson.lastmodified = toUTC(s.updated).isoformat()
+
+    #Find/list all data dictionnary
+    data = rrajson.details.data
+    if plan['data_dictionary'] is not None:
+        header, required = plan['data_dictionary']
+        try:
+            i, pos = locate(sheet_data, version, (header,))
+            data_dictionary = table_at(sheet_data, pos, [0, -2], max_rows=100)
+        except IndexError:
+            if required:
+                raise
+            #No data dictionary then!
+            data_dictionary = []
+
+        # if there are more than 100 datatypes, well, that's too many anyway.
+        # the 100 limit is a safeguard in case the loop goes wrong due to unexpected data in the sheet
+        for data_level, data_type in data_dictionary:
+            data_level = normalize_data_level(data_level)
+            for d in data_levels:
+                if data_level == d:
+                    try:
+                        data[d].append(data_type)
+                    except KeyError:
+                        data[d] = [data_type]
+
+    # if there are more than 100 recommendations, that's too many anyway.
+    # the 100 limit is a safeguard in case the loop goes wrong due to unexpected data in the sheet
+    if plan['recommendations'] is not None:
+        R = rrajson.details.recommendations
+        i, pos = locate(sheet_data, version, (plan['recommendations'],))
+        for recommendation, control_need in table_at(sheet_data, pos, [0, 8], max_rows=99):
+            # risk_levels are the same as control_need levels (they're standard!), so using them for validation.
+            R[validate_entry(control_need, risk_levels)].append(recommendation)
+
+    return rrajson
+
+def drift_summary():
+    '''
+    Returns a list of "version field: label (count), ..." strings for the fields that were found under a fallback
+    label at least once, i.e. where templates drifted.
+    '''
+    fields = collections.OrderedDict()
+    for (version, path, i, label), count in sorted(label_stats.items()):
+        fields.setdefault((version, path), []).append((i, label, count))
+
+    res = []
+    for (version, path), found in fields.items():
+        if found[-1][0] > 0:
+            res.append('{} {}: {}'.format(version, path, ', '.join(['{} ({})'.format(l, c) for i, l, c in found])))
+    return res
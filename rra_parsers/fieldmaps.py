@@ -0,0 +1,150 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+# Where to find each field of the RRA JSON document, per RRA template version. See engine.py for how these are used.
+#
+# Each version is a dict with:
+#  - fields: output field (path in the RRA JSON document) => (label, xmoves, ymoves, validator, fallbacks)
+#      label, xmoves, ymoves: see parselib.cell_value_near()
+#      validator: None, or one of engine.VALIDATORS ('risk', 'data_level', 'team', 'comma')
+#      fallbacks: labels to try in order when label isn't in the sheet, either as a string (same xmoves, ymoves) or
+#      as a (label, xmoves, ymoves) tuple. If neither label nor any of the fallbacks is found, parsing fails.
+#  - data_dictionary: (header label, required) of the data classification table, or None
+#  - recommendations: header label of the recommendations table, or None
+#  - base: optional version this one is based on. Its fields are inherited, fields set to None here are removed.
+#
+# Adding support for a new RRA template version usually means adding an entry here, based on the previous version.
+
+# Order in which risks are listed in most templates, i.e. risk_column()'s ymoves are for these fields
+RISKS = [('confidentiality', 'reputation'), ('confidentiality', 'productivity'), ('confidentiality', 'finances'),
+        ('availability', 'reputation'), ('availability', 'productivity'), ('availability', 'finances'),
+        ('integrity', 'reputation'), ('integrity', 'productivity'), ('integrity', 'finances')]
+
+def risk_column(attribute, label, validator=None, fallbacks=[], ymoves=range(1, 10)):
+    '''
+    Fields for one attribute (impact, rationale, probability) of all risks, read from the column under @label.
+    @ymoves: rows under @label for each of RISKS
+    '''
+    fields = {}
+    for (cia, area), y in zip(RISKS, ymoves):
+        fields['details.risk.{}.{}.{}'.format(cia, area, attribute)] = (label, 0, y, validator, fallbacks)
+    return fields
+
+def merge(*dicts):
+    res = {}
+    for d in dicts:
+        res.update(d)
+    return res
+
+FIELD_MAPS = {}
+
+FIELD_MAPS['230'] = {
+    'fields': merge({
+        'details.metadata.service':         ('Service name', 1, 0, None, []),
+        'details.metadata.scope':           ('RRA Scope', 1, 0, None, []),
+        'details.metadata.owner':           ('Service owner', 1, 0, 'team', []),
+        'details.metadata.developer':       ('Developer', 1, 0, 'team', []),
+        'details.metadata.operator':        ('Operator', 1, 0, 'team', []),
+        'details.data.default':             ('Data classification', 2, 0, 'data_level',
+                                                ['Data classification of primary service']),
+        # RRA 2.3 comes in two layouts, a table under "Impact Level" or a grid right of "Impact to Mozilla"
+        'details.risk.confidentiality.reputation.impact':   ('Impact Level', 0, 1, 'risk', [('Impact to Mozilla', 2, 2)]),
+        'details.risk.confidentiality.finances.impact':     ('Impact Level', 0, 3, 'risk', [('Impact to Mozilla', 3, 2)]),
+        'details.risk.confidentiality.productivity.impact': ('Impact Level', 0, 2, 'risk', [('Impact to Mozilla', 4, 2)]),
+        'details.risk.integrity.reputation.impact':         ('Impact Level', 0, 7, 'risk', [('Impact to Mozilla', 2, 3)]),
+        'details.risk.integrity.finances.impact':           ('Impact Level', 0, 9, 'risk', [('Impact to Mozilla', 3, 3)]),
+        'details.risk.integrity.productivity.impact':       ('Impact Level', 0, 8, 'risk', [('Impact to Mozilla', 4, 3)]),
+        'details.risk.availability.reputation.impact':      ('Impact Level', 0, 4, 'risk', [('Impact to Mozilla', 2, 4)]),
+        'details.risk.availability.finances.impact':        ('Impact Level', 0, 6, 'risk', [('Impact to Mozilla', 3, 4)]),
+        'details.risk.availability.productivity.impact':    ('Impact Level', 0, 5, 'risk', [('Impact to Mozilla', 4, 4)]),
+        },
+        risk_column('rationale', 'Rationale', ymoves=[1, 4, 7, 2, 5, 8, 3, 6, 9])),
+    'data_dictionary': ('Classification', False),
+    'recommendations': None,
+}
+
+FIELD_MAPS['241'] = {
+    'fields': merge({
+        'details.metadata.service':         ('Service name', 1, 0, None, []),
+        'details.metadata.scope':           ('RRA Scope', 1, 0, None, []),
+        'details.metadata.owner':           ('Service owner', 1, 0, 'team', []),
+        'details.metadata.developer':       ('Developer', 1, 0, 'team', []),
+        'details.metadata.operator':        ('Operator', 1, 0, 'team', []),
+        'details.data.default':             ('Service Data classification', 2, 0, 'data_level', []),
+        },
+        risk_column('impact', 'Impact', 'risk'),
+        risk_column('rationale', 'Rationale'),
+        #Depending on the weather this field is called Probability or Likelihood... the format is otherwise identical.
+        risk_column('probability', 'Probability', 'risk', ['Likelihood'])),
+    'data_dictionary': ('Data Classification', True),
+    'recommendations': None,
+}
+
+FIELD_MAPS['243'] = {
+    'base': '241',
+    'fields': {
+        'details.metadata.linked_services': ('Linked services', 1, 0, 'comma', []),
+        'details.metadata.risk_record':     ('Risk Record', 1, 0, None, []),
+    },
+}
+
+FIELD_MAPS['250'] = {
+    'base': '243',
+    'fields': merge({
+        'details.metadata.owner':           ('Service owner', 1, 0, None, []),
+        'details.metadata.developer':       ('Developer', 1, 0, None, []),
+        'details.metadata.operator':        ('Operator', 1, 0, None, []),
+        },
+        risk_column('rationale', 'Threats, use-cases, rationales'),
+        risk_column('probability', 'Probability', 'risk', ['Est. Probability'])),
+}
+
+FIELD_MAPS['251'] = {
+    'base': '250',
+    'fields': {},
+    'recommendations': 'Recommendations (Follow-up in a risk record bug)',
+}
+
+# From here on, there's a single probability per C/I/A
+FIELD_MAPS['252'] = {
+    'base': '251',
+    'fields': risk_column('probability', 'Probability', 'risk', ['Est. Probability'], ymoves=[1, 1, 1, 4, 4, 4, 7, 7, 7]),
+}
+
+FIELD_MAPS['253'] = {
+    'base': '252',
+    'fields': risk_column('probability', 'Probability', 'risk', ['Likelihood Indicator'],
+        ymoves=[1, 1, 1, 4, 4, 4, 7, 7, 7]),
+}
+
+FIELD_MAPS['254'] = {
+    'base': '253',
+    'fields': {
+        'details.metadata.analyst':         ('RRA Analyst', 1, 0, None, ['Risk Analyst']),
+    },
+}
+
+FIELD_MAPS['255'] = {
+    'base': '254',
+    'fields': {
+        'details.metadata.scope':           ('Scoped for team', 1, 0, None, ['Audience']),
+        'details.metadata.owner':           ('Service Owner', 2, 0, None, []),
+        'details.metadata.description':     ('Description', 1, 0, None, []),
+        'details.metadata.analyst':         ('RRA Analyst', 1, 0, None, [('Risk Analyst', 2, 0)]),
+        'details.metadata.contacts':        ('Other Contacts', 1, 0, 'comma', []),
+        'details.metadata.service_provided': ('Service provided', 1, 0, None, []),
+        'details.metadata.developer':       None,
+        'details.metadata.operator':        None,
+        'details.metadata.linked_services': None,
+    },
+}
+
+FIELD_MAPS['256'] = {
+    'base': '255',
+    'fields': {},
+}
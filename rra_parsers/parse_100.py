@@ -26,11 +26,9 @@ def parse_rra(gc, sheet, name, version, rrajson, data_levels, risk_levels):
         return None
 
     metadata.scope = cell_value_near(sheet_data, 'Scope')
-    try:
-        metadata.owner = fuzzy_find_team_name(cell_value_near(sheet_data, 'Project, Data owner') + ' ' + cell_value_near(sheet_data, 'Project, Data owner', xmoves=2))
-    except IndexError:
-        #<100 format, really
-        metadata.owner = fuzzy_find_team_name(cell_value_near(sheet_data, 'Owner') + ' ' + cell_value_near(sheet_data, 'Owner', xmoves=2))
+    #'Owner' is the <100 format, really
+    i, owner = find_label(sheet_data, ['Project, Data owner', 'Owner'])
+    metadata.owner = fuzzy_find_team_name(cell_at(sheet_data, owner) + ' ' + cell_at(sheet_data, owner, xmoves=2))
 
     metadata.developer = fuzzy_find_team_name(cell_value_near(sheet_data, 'Developer') + ' ' + cell_value_near(sheet_data, 'Developer', xmoves=2))
     metadata.operator = fuzzy_find_team_name(cell_value_near(sheet_data, 'Operator') + ' ' + cell_value_near(sheet_data, 'Operator', xmoves=2))
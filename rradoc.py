@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+# RRA JSON document model. Each part of the document is a record with a fixed set of fields (__slots__), which can
+# be accessed as attributes (rrajson.details.metadata.service) or items (rrajson['details']['metadata']['service']).
+# to_dict()/to_json() produce the document described by "rrajson" in rra2json.inc.json.
+
+import json
+import hashlib
+
+# Fields left out of digest(): timestamp and version change on every run, lastmodified (and version, derived from
+# it) whenever the spreadsheet is touched, even if the RRA itself did not change
+VOLATILE_FIELDS = ('timestamp', 'lastmodified', 'version')
+
+class Record(object):
+    '''
+    Base class of the document model.
+    Fields are serialized in __slots__ order. Fields listed in optional are None until set, and only serialized once
+    set, as not all RRA versions have them.
+    '''
+    __slots__ = ()
+    optional = ()
+
+    def __init__(self, **kwargs):
+        for k in self.optional:
+            setattr(self, k, None)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key, None) is not None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def update(self, d):
+        '''Set fields from @d, as returned by to_dict()'''
+        for k, v in d.items():
+            cur = getattr(self, k, None)
+            if isinstance(cur, Record):
+                cur.update(v)
+            else:
+                self[k] = plain(v)
+
+    def to_dict(self):
+        res = {}
+        for k in self.__slots__:
+            v = getattr(self, k)
+            if v is None and k in self.optional:
+                continue
+            res[k] = plain(v)
+        return res
+
+def plain(value):
+    '''Document model value => JSON-serializable value'''
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return dict([(k, plain(v)) for k, v in value.items()])
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+class Metadata(Record):
+    __slots__ = ('service', 'description', 'scope', 'owner', 'developer', 'operator', 'analyst', 'linked_services',
+            'risk_record', 'RRA_version', 'contacts', 'service_provided')
+    optional = ('contacts', 'service_provided')
+
+    def __init__(self):
+        Record.__init__(self, service='', description='', scope='', owner='', developer='', operator='', analyst='',
+                linked_services='', risk_record='', RRA_version='')
+
+class Data(Record):
+    '''
+    Default data level, and the list of data types of each data level. Data levels are accessed as items, e.g.
+    data['PUBLIC'], and serialized next to default.
+    '''
+    __slots__ = ('default', 'levels')
+
+    def __init__(self, data_levels):
+        self.default = ''
+        self.levels = dict([(level, []) for level in data_levels])
+
+    def __getitem__(self, key):
+        if key == 'default':
+            return self.default
+        return self.levels[key]
+
+    def __setitem__(self, key, value):
+        if key == 'default':
+            self.default = value
+        else:
+            self.levels[key] = value
+
+    def __contains__(self, key):
+        return key == 'default' or key in self.levels
+
+    def to_dict(self):
+        res = plain(self.levels)
+        res['default'] = self.default
+        return res
+
+class Risk(Record):
+    __slots__ = ('rationale', 'impact', 'probability')
+
+    def __init__(self):
+        Record.__init__(self, rationale='', impact='', probability='')
+
+class RiskAttribute(Record):
+    '''Risks to one of confidentiality, integrity, availability'''
+    __slots__ = ('reputation', 'finances', 'productivity')
+
+    def __init__(self):
+        Record.__init__(self, reputation=Risk(), finances=Risk(), productivity=Risk())
+
+class Risks(Record):
+    __slots__ = ('confidentiality', 'integrity', 'availability')
+
+    def __init__(self):
+        Record.__init__(self, confidentiality=RiskAttribute(), integrity=RiskAttribute(), availability=RiskAttribute())
+
+class Details(Record):
+    __slots__ = ('metadata', 'data', 'recommendations', 'risk')
+
+    def __init__(self, data_levels, risk_levels):
+        # Recommendations are listed by control need, which uses the same levels as risks
+        Record.__init__(self, metadata=Metadata(), data=Data(data_levels),
+                recommendations=dict([(level, []) for level in risk_levels]), risk=Risks())
+
+class RRADocument(Record):
+    __slots__ = ('timestamp', 'lastmodified', 'summary', 'source', 'category', 'severity', 'tags', 'details', 'version')
+    optional = ('version',)
+
+    def __init__(self, category, severity, tags, data_levels, risk_levels):
+        Record.__init__(self, timestamp='', lastmodified='', summary='', source='', category=category,
+                severity=severity, tags=list(tags), details=Details(data_levels, risk_levels))
+
+    @classmethod
+    def from_skeleton(cls, skel):
+        '''
+        New, empty document from the "rrajson" configuration: constant fields are copied from it, data and
+        recommendation levels are those listed in it.
+        '''
+        data_levels = [k for k in skel['details']['data'] if k != 'default']
+        return cls(skel['category'], skel['severity'], skel['tags'], data_levels, skel['details']['recommendations'])
+
+    @classmethod
+    def from_dict(cls, d):
+        '''Document from to_dict() output, e.g. when it was parsed in another process'''
+        doc = cls(d['category'], d['severity'], d['tags'], [], [])
+        doc.update(d)
+        return doc
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def digest(self):
+        return digest(self.to_dict())
+
+def digest(d):
+    '''
+    Content digest of a document (to_dict() output), stable from one run to the next as long as the RRA itself does
+    not change: VOLATILE_FIELDS are left out and keys are sorted.
+    '''
+    content = dict([(k, v) for k, v in d.items() if k not in VOLATILE_FIELDS])
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
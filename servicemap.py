@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+import io
+import gzip
+import time
+import random
+import requests
+import ratelimit
+
+# Bulk endpoint responses that mean it's not available on this server at all
+BULK_UNSUPPORTED = [404, 405, 501]
+
+class ServiceMap(object):
+    '''
+    Service-map API client. All requests go through a single keep-alive session, so that connections (and their TLS
+    handshake) are reused from one RRA to the next.
+    If bulk_endpoint is configured, RRAs can be queue()d and are then sent in batches, see flush().
+    Transient errors are retried with exponential backoff (with jitter). After breaker_threshold RRAs in a row failed
+    that way, service-map is considered down and nothing is sent for breaker_cooldown seconds.
+    RRAs that could not be sent are listed in self.failed and put in @dlq.
+    Content digests (rradoc.digest()) of posted RRAs are kept in self.digests, so that RRAs that did not change since
+    they were last posted are not sent again, see unchanged().
+    @cfg "servicemap" configuration
+    @dlq deadletter.DeadLetterQueue or None
+    @digests dict RRA source => digest of the last RRA posted, as left in self.digests by the previous run
+    @force if True, RRAs are always sent, even if unchanged
+    '''
+    def __init__(self, cfg, dlq=None, digests=None, force=False):
+        self.cfg = cfg
+        self.url = '{proto}://{host}:{port}{endpoint}'.format(proto=cfg['proto'], host=cfg['host'],
+                port=cfg['port'], endpoint=cfg['endpoint'])
+        self.timeout = (cfg.get('connect_timeout', 5), cfg.get('read_timeout', 30))
+        self.gzip = cfg.get('gzip', 'false') == 'true'
+        self.retries = cfg.get('retries', 3)
+        self.backoff = cfg.get('backoff', 1.0)
+        self.breaker_threshold = cfg.get('breaker_threshold', 5)
+        self.breaker_cooldown = cfg.get('breaker_cooldown', 60)
+        self.dlq = dlq
+        self.digests = digests if digests is not None else {}
+        self.force = force
+        # RRA source => digest, for RRAs sent or queued but not posted yet
+        self._sent_digests = {}
+        self._down = 0
+        self._closed_at = 0
+
+        self.bulk_url = None
+        if len(cfg.get('bulk_endpoint', '')) > 0:
+            self.bulk_url = '{proto}://{host}:{port}{endpoint}'.format(proto=cfg['proto'], host=cfg['host'],
+                    port=cfg['port'], endpoint=cfg['bulk_endpoint'])
+        self.bulk_format = cfg.get('bulk_format', 'json')
+        self.bulk_max_docs = cfg.get('bulk_max_docs', 50)
+        self.bulk_max_bytes = cfg.get('bulk_max_bytes', 1024*1024)
+        self._queue = []
+        self._queued_bytes = 0
+        # RRA source => error, for queued RRAs that could not be posted
+        self.failed = {}
+        self.stats = {'batches': 0, 'fallbacks': 0, 'posted': 0, 'failed': 0, 'retries': 0,
+                'unchanged': 0}
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=cfg.get('pool_size', 4))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'SERVICEAPIKEY': cfg['apikey']})
+
+        if len(cfg.get('x509cert', '')) > 1:
+            self.session.verify = cfg['x509cert']
+        elif cfg['tls_verify'] == "true":
+            self.session.verify = True
+        else:
+            self.session.verify = False
+
+    def post(self, payload, url=None, headers={}):
+        '''
+        POST @payload (str) to @url, the configured endpoint by default. Returns the requests response.
+        Raises requests.exceptions.RequestException on connection errors and timeouts.
+        '''
+        data = payload.encode('utf-8')
+        headers = dict(headers)
+        if self.gzip:
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(data)
+            data = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        return self.session.post(url or self.url, data=data, headers=headers, timeout=self.timeout)
+
+    def _circuit_open(self):
+        # Once the cooldown is over, the next request goes through: if it fails again, the circuit opens again
+        return self._down >= self.breaker_threshold and time.time() < self._closed_at
+
+    def _post(self, payload, url=None, headers={}):
+        '''
+        post() with retries on connection errors and transient server errors.
+        Returns (response or None, error or None), error being None if service-map answered 200.
+        '''
+        if self._circuit_open():
+            return None, 'service-map is down, not sending anything until {}'.format(time.ctime(self._closed_at))
+
+        attempt = 0
+        while True:
+            try:
+                r = self.post(payload, url, headers)
+            except requests.exceptions.RequestException as e:
+                r = None
+                error = str(e)
+                transient = True
+            else:
+                if r.status_code == requests.codes.ok:
+                    error = None
+                else:
+                    error = 'error code: {} message: {}'.format(r.status_code, r.content)
+                transient = r.status_code in ratelimit.THROTTLE_CODES
+
+            if error is None or not transient or attempt >= self.retries:
+                break
+            self.stats['retries'] = self.stats['retries'] + 1
+            time.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt = attempt + 1
+
+        if error is not None and transient:
+            self._down = self._down + 1
+            if self._down >= self.breaker_threshold:
+                self._closed_at = time.time() + self.breaker_cooldown
+        else:
+            self._down = 0
+        return r, error
+
+    def unchanged(self, source, digest):
+        '''
+        Returns True if the RRA was last posted with the same @digest, in which case there's no need to send it again.
+        '''
+        if self.force or self.digests.get(source) != digest:
+            return False
+        self.stats['unchanged'] = self.stats['unchanged'] + 1
+        # An older version may still be waiting in the dead-letter queue, it must not replace this one
+        if self.dlq is not None:
+            self.dlq.remove(source)
+        return True
+
+    def send(self, source, payload, digest=None):
+        '''
+        Send a single RRA to the configured endpoint.
+        Returns None if it was posted, or the error.
+        @source RRA source (spreadsheet id)
+        @payload RRA JSON document (str)
+        @digest rradoc.digest() of the RRA, remembered in self.digests once posted
+        '''
+        if digest is not None:
+            self._sent_digests[source] = digest
+        r, error = self._post(payload)
+        self._result(source, error, payload)
+        return error
+
+    @property
+    def bulk(self):
+        return self.bulk_url is not None
+
+    def queue(self, source, payload, digest=None):
+        '''
+        Add an RRA to the next batch, and send the batch once it holds bulk_max_docs RRAs or bulk_max_bytes.
+        @source RRA source (spreadsheet id), used to report failures in self.failed
+        @payload RRA JSON document (str)
+        @digest see send()
+        '''
+        if digest is not None:
+            self._sent_digests[source] = digest
+        if len(self._queue) > 0 and self._queued_bytes + len(payload) > self.bulk_max_bytes:
+            self.flush()
+        self._queue.append((source, payload))
+        self._queued_bytes = self._queued_bytes + len(payload)
+        if len(self._queue) >= self.bulk_max_docs:
+            self.flush()
+
+    def flush(self):
+        '''
+        Send queued RRAs in one request to the bulk endpoint, as a JSON array or as NDJSON (one document per line).
+        The server answers with a JSON array holding a result for each RRA, in the same order:
+        {"status": "ok"} or {"status": "error", "error": "why"}. RRAs that failed are added to self.failed.
+        If the batch is rejected as a whole, its RRAs are posted one by one instead, and if the bulk endpoint is not
+        available at all, queue()d RRAs are posted one by one from then on.
+        '''
+        batch = self._queue
+        self._queue = []
+        self._queued_bytes = 0
+        if len(batch) == 0:
+            return
+
+        if self.bulk_format == 'ndjson':
+            body = '\n'.join([payload for source, payload in batch]) + '\n'
+            content_type = 'application/x-ndjson'
+        else:
+            body = '[' + ','.join([payload for source, payload in batch]) + ']'
+            content_type = 'application/json'
+
+        r, error = self._post(body, self.bulk_url, {'Content-Type': content_type})
+        if error is None:
+            self.stats['batches'] = self.stats['batches'] + 1
+            self._bulk_results(batch, r)
+            return
+
+        if r is not None and r.status_code in BULK_UNSUPPORTED:
+            self.bulk_url = None
+        self.stats['fallbacks'] = self.stats['fallbacks'] + 1
+        for source, payload in batch:
+            self.send(source, payload)
+
+    def _bulk_results(self, batch, r):
+        try:
+            results = r.json()
+        except ValueError:
+            results = None
+        if not isinstance(results, list) or len(results) != len(batch):
+            # No usable per-RRA results, the batch was accepted as a whole
+            results = [{'status': 'ok'}] * len(batch)
+
+        for (source, payload), result in zip(batch, results):
+            if isinstance(result, dict) and result.get('status', 'ok') != 'ok':
+                self._result(source, result.get('error', result.get('status')), payload)
+            else:
+                self._result(source, None, payload)
+
+    def _result(self, source, error, payload):
+        if error is None:
+            self.stats['posted'] = self.stats['posted'] + 1
+            self.failed.pop(source, None)
+            if source in self._sent_digests:
+                self.digests[source] = self._sent_digests.pop(source)
+            if self.dlq is not None:
+                self.dlq.remove(source)
+        else:
+            self.stats['failed'] = self.stats['failed'] + 1
+            self.failed[source] = error
+            self._sent_digests.pop(source, None)
+            if self.dlq is not None:
+                self.dlq.put(source, payload)
+
+    def summary(self):
+        return ('{posted} RRA(s) posted ({batches} batch(es), {fallbacks} batch(es) posted one by one), {unchanged} '
+                'unchanged RRA(s) not sent, {retries} retries, {failed} failure(s)').format(**self.stats)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copyright (c) 2016 Mozilla Corporation
+# Contributors:
+# Guillaume Destuynder <gdestuynder@mozilla.com>
+
+import os
+import io
+import csv
+import json
+import datetime
+from parselib import SheetIndex
+
+class WorksheetGrid(object):
+    '''
+    In-memory copy of a worksheet's cells. Quacks enough like gspread.models.Worksheet for version detection and the
+    rra_parsers.
+    '''
+    def __init__(self, title, updated, data):
+        self.title = title
+        self.updated = updated
+        self.data = SheetIndex(data)
+
+    def get_all_values(self):
+        '''Same format as gspread's: data[row][col] with positions starting at 0, as a parselib.SheetIndex so that
+        label lookups by the parsers are cheap'''
+        return self.data
+
+    def value(self, row, col):
+        '''
+        Value of a cell, with gspread-style coordinates (starting at 1, i.e. P1 is value(1, 16))
+        Returns an empty string for cells outside of the grid, like gspread does for empty cells.
+        '''
+        try:
+            return self.data[row-1][col-1]
+        except IndexError:
+            return ''
+
+class SpreadsheetGrid(object):
+    '''
+    Wraps a gspread.models.Spreadsheet so that each worksheet is fetched at most once, with a single
+    get_all_values() call. The same grid is then shared by version detection and the parser.
+    If @limiter (ratelimit.RateLimiter) is set, all Google API calls go through it.
+    If @cache (gridcache.GridCache) is set, worksheets are looked up there first, and stored there once fetched.
+    '''
+    def __init__(self, spreadsheet, limiter=None, cache=None):
+        self.id = spreadsheet.id
+        self.updated = spreadsheet.updated
+        self._spreadsheet = spreadsheet
+        self._limiter = limiter
+        self._cache = cache
+        self._sheet1 = None
+        self._worksheets = {}
+
+    @property
+    def sheet1(self):
+        if self._sheet1 is None:
+            # The first worksheet's title is only known once it's fetched, so it's cached under the title None
+            self._sheet1 = self._load(None, self._spreadsheet.get_worksheet, 0)
+            self._worksheets.setdefault(self._sheet1.title, self._sheet1)
+        return self._sheet1
+
+    def worksheet(self, title):
+        if title not in self._worksheets:
+            self._worksheets[title] = self._load(title, self._spreadsheet.worksheet, title)
+        return self._worksheets[title]
+
+    def _load(self, title, func, *args):
+        if self._cache is not None:
+            entry = self._cache.get(self.id, title, self.updated)
+            if entry is not None:
+                return WorksheetGrid(entry['title'], entry['updated'], entry['data'])
+
+        ws = self._call(func, *args)
+        grid = WorksheetGrid(ws.title, ws.updated, self._call(ws.get_all_values))
+        if self._cache is not None:
+            self._cache.put(self.id, title, self.updated, {'title': grid.title, 'updated': grid.updated,
+                'data': grid.data})
+        return grid
+
+    def _call(self, func, *args):
+        if self._limiter is None:
+            return func(*args)
+        return self._limiter.call(func, *args)
+
+class SnapshotGrid(object):
+    '''
+    Spreadsheet look-alike built from an exported snapshot rather than from Google Drive, for offline replay. Same
+    interface as SpreadsheetGrid.
+    @worksheets list of WorksheetGrid, first one being sheet1
+    '''
+    def __init__(self, id, title, updated, worksheets):
+        self.id = id
+        self.title = title
+        self.updated = updated
+        self.sheet1 = worksheets[0]
+        self._worksheets = {}
+        for ws in worksheets:
+            self._worksheets.setdefault(ws.title, ws)
+
+    def worksheet(self, title):
+        return self._worksheets[title]
+
+    def to_dict(self):
+        '''Plain data (JSON snapshot format, see load_snapshot()), e.g. to hand it over to another process'''
+        worksheets = [self.sheet1] + [ws for ws in self._worksheets.values() if ws is not self.sheet1]
+        return {'id': self.id, 'title': self.title, 'updated': self.updated,
+                'worksheets': [{'title': ws.title, 'updated': ws.updated, 'values': list(ws.data)} for ws in worksheets]}
+
+def snapshot_from_dict(snap):
+    '''SnapshotGrid from the JSON snapshot format, see load_snapshot()'''
+    worksheets = [WorksheetGrid(ws['title'], ws['updated'], ws['values']) for ws in snap['worksheets']]
+    return SnapshotGrid(snap['id'], snap['title'], snap['updated'], worksheets)
+
+def load_snapshot(path):
+    '''
+    Load a snapshot file and return a SnapshotGrid. Two formats are supported:
+    - JSON: {"id": ..., "title": ..., "updated": ..., "worksheets": [{"title": ..., "updated": ..., "values": grid}]}
+      where grid is get_all_values() output and the first worksheet is sheet1.
+    - CSV: the first worksheet only, with the file name (minus .csv) as spreadsheet id and title, 'Sheet1' as worksheet
+      title and the file modification time as updated date. RRA 1.x documents need the JSON format, as they're
+      detected by their worksheet title and parsed from two worksheets.
+    '''
+    if path.endswith('.json'):
+        with io.open(path, encoding='utf-8') as f:
+            return snapshot_from_dict(json.load(f))
+
+    sheet_id = os.path.basename(path)[:-len('.csv')]
+    updated = datetime.datetime.utcfromtimestamp(os.path.getmtime(path)).isoformat() + 'Z'
+    with open(path) as f:
+        data = [row for row in csv.reader(f)]
+    return SnapshotGrid(sheet_id, sheet_id, updated, [WorksheetGrid('Sheet1', updated, data)])
+
+def load_snapshots(path):
+    '''Yields a SnapshotGrid for every .json or .csv snapshot in directory @path, in file name order'''
+    for fname in sorted(os.listdir(path)):
+        if fname.endswith('.json') or fname.endswith('.csv'):
+            yield load_snapshot(os.path.join(path, fname))
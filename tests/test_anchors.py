@@ -0,0 +1,48 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+from parselib import SheetIndex
+from rra_parsers import engine
+
+@pytest.fixture(autouse=True)
+def clean_anchors():
+    engine.anchors.clear()
+    engine.anchor_stats.clear()
+    yield
+    engine.anchors.clear()
+    engine.anchor_stats.clear()
+
+def grid():
+    return SheetIndex([
+        ['', 'Title', ''],
+        ['Service name', 'foo', ''],
+        ['', 'Probability', 'High'],
+    ])
+
+def test_hit_does_not_index_the_grid():
+    engine.anchors['1.0'] = {'Probability': [2, 1]}
+    sheet = grid()
+    assert engine.locate(sheet, '1.0', ('Probability',)) == (0, [2, 1])
+    assert engine.anchor_stats['hits'] == 1
+    assert sheet._labels is None
+
+def test_label_also_found_earlier():
+    engine.anchors['1.0'] = {'Probability': [2, 1]}
+    sheet = grid()
+    sheet[0][2] = 'probability '
+    assert engine.locate(sheet, '1.0', ('Probability',)) == (0, (0, 2))
+    assert engine.anchor_stats['hits'] == 0
+    assert engine.anchor_stats['searches'] == 1
+    assert engine.anchors['1.0']['Probability'] == [0, 2]
+
+def test_fallback_label_not_remembered():
+    sheet = grid()
+    assert engine.locate(sheet, '1.0', ('Likelihood Indicator', 'Probability')) == (1, (2, 1))
+    assert engine.anchors['1.0'] == {}